@@ -6,53 +6,77 @@ AI Agent - Main Entry Point
 Professional AI coding assistant with advanced capabilities.
 """
 
+import os
 import sys
 import argparse
-from pathlib import Path
-from typing import Optional
-import os
-import json
+import functools
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+from src._json import loads as _json_loads, dumps as _json_dumps, dumps_pretty as _json_dumps_pretty
+
+_MODEL_CHOICES = ("gemini-2.0-flash-001", "gemini-1.5-pro")
+_MODEL_SET = frozenset(_MODEL_CHOICES)
+_FORMAT_CHOICES = ("text", "markdown", "json")
+
+# The agent, config and CLI modules pull in the Gemini SDK and Rich, so they
+# are imported inside main() only once argparse has picked a code path.
+
+
+@dataclass(slots=True, frozen=True)
+class FunctionCallPart:
+    """A tool invocation: the function name and its JSON-encoded arguments."""
+    name: str
+    args: str
+
+
+def _tool_write_file(arguments: dict) -> dict:
+    """Write ``content`` to ``file_path``."""
+    from src.tools.file_tools import write_file
+
+    try:
+        file_path = arguments["file_path"]
+        result = write_file(file_path, arguments["content"])
+        if "error" in result:
+            return {"response": f"Error writing file: {result['error']}"}
+        return {"response": f"File written successfully to {file_path}"}
+    except Exception as e:
+        return {"response": f"Error writing file: {e}"}
 
-# Add src to path
-sys.path.insert(0, str(Path(__file__).parent))
 
-from src.agent import Agent  # Assuming this exists
-from src.config import Config  # Assuming this exists
-from src.cli import InteractiveCLI  # Assuming this exists
+def _tool_read_file(arguments: dict) -> dict:
+    """Read the contents of ``file_path``."""
+    from src.tools.file_tools import read_file
+
+    try:
+        result = read_file(arguments["file_path"])
+        if "error" in result:
+            return {"response": f"Error reading file: {result['error']}"}
+        return {"response": result["content"]}
+    except Exception as e:
+        return {"response": f"Error reading file: {e}"}
+
+
+# Tool name -> handler, built once at import time
+_DISPATCH: Dict[str, Callable[[dict], dict]] = {
+    "write_file": _tool_write_file,
+    "read_file": _tool_read_file,
+}
 
 
 # Simplified call_function and available_functions for file I/O
 def call_function(function_call_part, verbose=False):
     """Calls a function based on the function call part."""
     name = function_call_part.name
-    arguments = json.loads(function_call_part.args)
+    arguments = _json_loads(function_call_part.args)
 
     if verbose:
         print(f"Calling function: {name} with arguments: {arguments}")
 
-    if name == "write_file":
-        try:
-            file_path = arguments["file_path"]
-            content = arguments["content"]
-            result = default_api.write_file(file_path=file_path, content=content)
-            response = {"response": f"File written successfully to {file_path}"}
-            return response
-        except Exception as e:
-            response = {"response": f"Error writing file: {e}"}
-            return response
-    elif name == "read_file":
-        try:
-            file_path = arguments["file_path"]
-            result = default_api.get_file_content(file_path=file_path)
-            content = result['get_file_content_response']['result']
-            response = {"response": content}
-            return response
-        except Exception as e:
-            response = {"response": f"Error reading file: {e}"}
-            return response
-    else:
-        response = {"response": f"Function {name} not supported"}
-        return response
+    handler = _DISPATCH.get(name)
+    if handler is None:
+        return {"response": f"Function {name} not supported"}
+    return handler(arguments)
 
 
 available_functions = {
@@ -97,27 +121,40 @@ available_functions = {
 }
 
 
-def main():
-    """Main entry point for the AI Agent."""
+def _model_choice(value: str) -> str:
+    """argparse type for --model: constant-time membership check."""
+    if value not in _MODEL_SET:
+        raise argparse.ArgumentTypeError(
+            f"invalid choice: {value!r} (choose from {', '.join(_MODEL_CHOICES)})"
+        )
+    return value
+
+
+@functools.lru_cache(maxsize=1)
+def _build_parser() -> argparse.ArgumentParser:
+    """Build the command-line parser (cached, it is immutable once built)."""
+    from src import __version__
+
     parser = argparse.ArgumentParser(
+        prog="agent_main.py",
         description="AI Agent - Professional AI Coding Assistant",
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog="""
 Examples:
   # Interactive mode
-  python agent.py
+  python agent_main.py
 
   # Single query
-  python agent.py "explain this code" --file main.py
+  python agent_main.py "explain this code" --file main.py
 
   # Write to file
-  python agent.py "write hello world to test.txt" --write_file test.txt --content "hello world"
+  python agent_main.py "write hello world to test.txt" --write_file test.txt --content "hello world"
 
   # With custom model
-  python agent.py "refactor this function" --model gemini-1.5-pro
+  python agent_main.py "refactor this function" --model gemini-1.5-pro
 
   # Export metrics
-  python agent.py --export-metrics
+  python agent_main.py --export-metrics
         """
     )
 
@@ -131,7 +168,8 @@ Examples:
     # Configuration options
     parser.add_argument(
         "--model",
-        choices=["gemini-2.0-flash-001", "gemini-1.5-pro"],
+        type=_model_choice,
+        metavar="{" + ",".join(_MODEL_CHOICES) + "}",
         help="AI model to use"
     )
     parser.add_argument(
@@ -168,7 +206,7 @@ Examples:
     )
     parser.add_argument(
         "--format",
-        choices=["text", "markdown", "json"],
+        choices=_FORMAT_CHOICES,
         default="text",
         help="Output format"
     )
@@ -194,6 +232,16 @@ Examples:
         type=str,
         help="Path to configuration file"
     )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Serve the query from a warm background agent (started on first use)"
+    )
+    parser.add_argument(
+        "--daemon-stop",
+        action="store_true",
+        help="Stop the warm background agent"
+    )
 
     # write_file argument
     parser.add_argument(
@@ -225,10 +273,288 @@ Examples:
         action="store_true",
         help="Enable debug logging"
     )
+    parser.add_argument(
+        "--version",
+        action="version",
+        version=f"ai_agent {__version__}"
+    )
+
+    return parser
+
+
+# Fast-path parser for the common invocation shapes. Maps every option
+# string the full parser accepts to (dest, converter); a converter of None
+# marks a store_true flag.
+_FAST_OPTIONS = {
+    "--model": ("model", _model_choice),
+    "--temperature": ("temperature", float),
+    "--max-iterations": ("max_iterations", int),
+    "--file": ("file", str),
+    "--dir": ("dir", str),
+    "--output": ("output", str),
+    "-o": ("output", str),
+    "--format": ("format", str),
+    "--export-metrics": ("export_metrics", None),
+    "--export-session": ("export_session", str),
+    "--search": ("search", str),
+    "--config": ("config", str),
+    "--daemon": ("daemon", None),
+    "--daemon-stop": ("daemon_stop", None),
+    "--write_file": ("write_file", str),
+    "--content": ("content", str),
+    "--read_file": ("read_file", str),
+    "--verbose": ("verbose", None),
+    "-v": ("verbose", None),
+    "--debug": ("debug", None),
+}
+
+_FAST_DEFAULTS = {
+    "query": None,
+    "model": None,
+    "temperature": None,
+    "max_iterations": None,
+    "file": None,
+    "dir": None,
+    "output": None,
+    "format": "text",
+    "export_metrics": False,
+    "export_session": None,
+    "search": None,
+    "config": None,
+    "daemon": False,
+    "daemon_stop": False,
+    "write_file": None,
+    "content": None,
+    "read_file": None,
+    "verbose": False,
+    "debug": False,
+}
+
+
+def _fast_parse(argv: list) -> Optional[argparse.Namespace]:
+    """
+    Parse argv without building the full ArgumentParser.
+
+    Returns None for anything it does not understand (help, unknown or
+    abbreviated options, ``--opt=value`` forms, invalid values) so the
+    caller can fall back to argparse for full handling and error messages.
+    """
+    values = dict(_FAST_DEFAULTS)
+    i = 0
+    n = len(argv)
+    while i < n:
+        token = argv[i]
+        i += 1
+        if token.startswith("-"):
+            option = _FAST_OPTIONS.get(token)
+            if option is None:
+                return None
+            dest, convert = option
+            if convert is None:
+                values[dest] = True
+                continue
+            if i >= n or argv[i].startswith("-"):
+                return None
+            try:
+                values[dest] = convert(argv[i])
+            except (ValueError, argparse.ArgumentTypeError):
+                return None
+            i += 1
+        elif values["query"] is None:
+            values["query"] = token
+        else:
+            return None
+
+    if values["format"] not in _FORMAT_CHOICES:
+        return None
+    return argparse.Namespace(**values)
+
+
+def _emit_response(args, response: str):
+    """Print the response or write it to --output in the requested format."""
+    if args.format == "json":
+        output = _json_dumps_pretty({"query": args.query, "response": response})
+        if not args.output:
+            _write_stdout_bytes(output)
+            return
+    else:
+        output = response.encode("utf-8")
+    if args.output:
+        _write_output(args.output, output)
+        print(f"Response written to {args.output}")
+    else:
+        print(response)
+
 
-    args = parser.parse_args()
+def _write_output(file_path: str, data: bytes):
+    """Write encoded output to a file path given on the command line."""
+    with open(file_path, "wb") as f:
+        f.write(data)
+
+
+def _write_stdout_bytes(data: bytes):
+    """Write pre-encoded output straight to the stdout buffer."""
+    sys.stdout.flush()
+    sys.stdout.buffer.write(data + b"\n")
+    sys.stdout.buffer.flush()
+
+
+def _stream_response(args, chunks):
+    """Write response chunks to --output or stdout as they are generated."""
+    if args.output:
+        with open(args.output, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk.encode("utf-8"))
+        print(f"Response written to {args.output}")
+    else:
+        for chunk in chunks:
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+        sys.stdout.write("\n")
+
+
+def _file_context(file_path: str) -> dict:
+    """Read --file into a request context, exiting if the file is missing."""
+    # Open directly (no exists() pre-check) and decode the raw bytes once
+    try:
+        with open(file_path, "rb") as f:
+            content = f.read().decode("utf-8", errors="replace")
+    except FileNotFoundError:
+        print(f"Error: File not found: {file_path}")
+        sys.exit(1)
+    return {"file": str(file_path), "file_content": content}
+
+
+def _query_daemon(args) -> Optional[str]:
+    """Answer a plain query through the warm daemon; None if it is unavailable."""
+    from src import daemon
+
+    if not daemon.is_supported():
+        return None
+
+    context = _file_context(args.file) if args.file else {}
+
+    payload = {
+        "query": args.query,
+        "cwd": os.getcwd(),
+        "context": context,
+        "model": args.model,
+        "temperature": args.temperature,
+        "max_iterations": args.max_iterations,
+    }
+    reply = daemon.request(payload)
+    # No reply from a live daemon means its worker died: answer in-process
+    if reply is None and not daemon.is_running() and daemon.spawn():
+        reply = daemon.request(payload)
+    if reply is None:
+        return None
+    if "error" in reply:
+        raise RuntimeError(reply["error"])
+    return reply["response"]
+
+
+# Pre-rendered ``--help`` output (80 columns) so plain help skips parser
+# construction. Regenerate from _build_parser().format_help() when options
+# change; tests check the two stay in sync.
+_STATIC_HELP = """\
+usage: agent_main.py [-h] [--model {gemini-2.0-flash-001,gemini-1.5-pro}]
+                     [--temperature T] [--max-iterations N] [--file FILE]
+                     [--dir DIR] [--output OUTPUT]
+                     [--format {text,markdown,json}] [--export-metrics]
+                     [--export-session ID] [--search QUERY] [--config CONFIG]
+                     [--daemon] [--daemon-stop] [--write_file WRITE_FILE]
+                     [--content CONTENT] [--read_file READ_FILE] [--verbose]
+                     [--debug] [--version]
+                     [query]
+
+AI Agent - Professional AI Coding Assistant
+
+positional arguments:
+  query                 Query to process (interactive mode if not provided)
+
+options:
+  -h, --help            show this help message and exit
+  --model {gemini-2.0-flash-001,gemini-1.5-pro}
+                        AI model to use
+  --temperature T       Temperature for response generation (0.0-2.0)
+  --max-iterations N    Maximum conversation iterations
+  --file FILE           File to include in context
+  --dir DIR             Working directory
+  --output OUTPUT, -o OUTPUT
+                        Output file for response
+  --format {text,markdown,json}
+                        Output format
+  --export-metrics      Export performance metrics
+  --export-session ID   Export specific session
+  --search QUERY        Search conversation history
+  --config CONFIG       Path to configuration file
+  --daemon              Serve the query from a warm background agent (started
+                        on first use)
+  --daemon-stop         Stop the warm background agent
+  --write_file WRITE_FILE
+                        Path to the file to write to
+  --content CONTENT     Content to write to the file
+  --read_file READ_FILE
+                        Path to the file to read from
+  --verbose, -v         Enable verbose output
+  --debug               Enable debug logging
+  --version             show program's version number and exit
+
+Examples:
+  # Interactive mode
+  python agent_main.py
+
+  # Single query
+  python agent_main.py "explain this code" --file main.py
+
+  # Write to file
+  python agent_main.py "write hello world to test.txt" --write_file test.txt --content "hello world"
+
+  # With custom model
+  python agent_main.py "refactor this function" --model gemini-1.5-pro
+
+  # Export metrics
+  python agent_main.py --export-metrics
+        
+"""
+
+
+def main():
+    """Main entry point for the AI Agent."""
+    argv = sys.argv[1:]
+    if len(argv) == 1 and argv[0] in ("-h", "--help"):
+        sys.stdout.write(_STATIC_HELP)
+        return
+    if argv == ["--version"]:
+        from src import __version__
+        sys.stdout.write(f"ai_agent {__version__}\n")
+        return
+
+    args = _fast_parse(argv)
+    if args is None:
+        args = _build_parser().parse_args()
+
+    from src.config import Config, ModelType, LogLevel
 
     try:
+        if args.temperature is not None and not 0 <= args.temperature <= 2:
+            print("Error: Temperature must be between 0 and 2")
+            sys.exit(1)
+
+        if args.daemon_stop:
+            from src import daemon
+            print("Daemon stopped" if daemon.stop() else "No daemon running")
+            return
+
+        # A warm daemon already holds an initialized agent; only plain
+        # queries without a config file or working-dir override go there.
+        if (args.daemon and args.query and not (args.config or args.dir)
+                and not (args.write_file or args.read_file)):
+            response = _query_daemon(args)
+            if response is not None:
+                _emit_response(args, response)
+                return
+
         # Load configuration
         if args.config:
             config = Config.from_file(args.config)
@@ -237,15 +563,10 @@ Examples:
 
         # Apply command-line overrides
         if args.model:
-            from src.config import ModelType
             config.model = ModelType(args.model)
 
         if args.temperature is not None:
-            if 0 <= args.temperature <= 2:
-                config.temperature = args.temperature
-            else:
-                print("Error: Temperature must be between 0 and 2")
-                sys.exit(1)
+            config.temperature = args.temperature
 
         if args.max_iterations:
             config.max_iterations = args.max_iterations
@@ -254,33 +575,30 @@ Examples:
             config.working_dir = args.dir
 
         if args.debug:
-            from src.config import LogLevel
             config.log_level = LogLevel.DEBUG
         elif args.verbose:
-            from src.config import LogLevel
             config.log_level = LogLevel.INFO
 
         # Create agent
+        from src.agent import Agent
         agent = Agent(config)
 
         # Handle utility operations
         if args.export_metrics:
-            metrics = agent.get_metrics()
-            import json
-            output = json.dumps(metrics, indent=2)
+            output = _json_dumps_pretty(agent.get_metrics())
 
             if args.output:
-                args.output.write_text(output)
+                _write_output(args.output, output)
                 print(f"Metrics exported to {args.output}")
             else:
-                print(output)
+                _write_stdout_bytes(output)
             return
 
         if args.export_session:
             try:
                 output = agent.export_session(args.export_session, format="json")
                 if args.output:
-                    args.output.write_text(output)
+                    _write_output(args.output, output.encode("utf-8"))
                     print(f"Session exported to {args.output}")
                 else:
                     print(output)
@@ -302,19 +620,8 @@ Examples:
         # Process query or start interactive mode
         if args.query:
             # Single query mode
-            context = {}
-
             # Add file context if provided
-            if args.file:
-                #context["file"] = str(args.file)
-                #context["file_content"] = args.file.read_text()
-                function_call_part = type('obj', (object,), {'name': 'read_file', 'args': json.dumps({'file_path': args.file})})()
-                file_content_response = call_function(function_call_part, verbose=args.verbose)
-                if file_content_response:
-                  context["file_content"] = file_content_response["response"]
-                else:
-                  print(f"Error reading file {args.file}")
-                  sys.exit(1)
+            context = _file_context(args.file) if args.file else {}
 
             # Process query
             # response = agent.process_request(args.query, context)  #Original
@@ -322,44 +629,47 @@ Examples:
             # Here's the modified part to handle write_file and read_file
             if args.write_file and args.content:
                 # Call write_file function directly
-                function_call_part = type('obj', (object,), {'name': 'write_file', 'args': json.dumps({'file_path': args.write_file, 'content': args.content})})()
+                function_call_part = FunctionCallPart('write_file', _json_dumps({'file_path': args.write_file, 'content': args.content}))
                 function_response = call_function(function_call_part, verbose=args.verbose)
                 print(function_response["response"]) # Print response
                 response = None # Set response to None so the next section will be skipped
             elif args.read_file:
                 # Call read_file function directly
-                function_call_part = type('obj', (object,), {'name': 'read_file', 'args': json.dumps({'file_path': args.read_file})})()
+                function_call_part = FunctionCallPart('read_file', _json_dumps({'file_path': args.read_file}))
                 function_response = call_function(function_call_part, verbose=args.verbose)
                 print(function_response["response"])  # Print response
                 response = None # Set response to None so the next section will be skipped
-            else:
+            elif args.format == "json":
                 response = agent.process_request(args.query, context)
+            else:
+                _stream_response(args, agent.process_request_stream(args.query, context))
+                response = None
 
             if response:
-                if args.output:
-                    if args.format == "json":
-                        output = json.dumps(response, indent=2)
-                    else:
-                        output = response["response"]
-                    with open(args.output, "w") as f:
-                        f.write(output)
-                    print(f"Response written to {args.output}")
-                else:
-                    print(response["response"])
+                _emit_response(args, response)
+
+            # Session saves are written behind; persist before exiting
+            agent.flush_session()
 
         else:
             # Interactive mode
+            from src.cli import InteractiveCLI
             cli = InteractiveCLI(agent)
             cli.run()
 
-    except Exception as e:
+    except (OSError, ValueError, KeyError, RuntimeError) as e:
+        # Expected failures (config, files, API errors) get a one-line message
+        if args.debug:
+            raise
         print(f"Error: {e}")
         sys.exit(1)
+    except Exception as e:
+        # Anything else is a bug: name it, and leave the traceback to --debug
+        if args.debug:
+            raise
+        print(f"Error: unexpected {type(e).__name__}: {e} (rerun with --debug for details)")
+        sys.exit(1)
 
 
-# The following code should be placed within the _generate_with_retry function in src/agent.py, replacing the original line.
-# total_tokens += response.usage_metadata.prompt_token_count + response.usage_metadata.completion_token_count
-# total_tokens += (response.usage_metadata.prompt_token_count or 0) + (response.usage_metadata.completion_token_count or 0)
-
 if __name__ == "__main__":
     main()
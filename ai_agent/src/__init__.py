@@ -9,8 +9,21 @@ for code analysis, project management, and intelligent task automation.
 __version__ = "2.0.0"
 __author__ = "AI Agent Team"
 
-from .agent import Agent
-from .config import Config
-from .conversation import ConversationManager
-
 __all__ = ["Agent", "Config", "ConversationManager"]
+
+# Resolved on first access so that importing a lightweight submodule
+# (e.g. src.daemon from the CLI) does not load the Gemini SDK.
+_LAZY_EXPORTS = {
+    "Agent": ".agent",
+    "Config": ".config",
+    "ConversationManager": ".conversation",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        import importlib
+        value = getattr(importlib.import_module(_LAZY_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
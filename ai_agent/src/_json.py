@@ -0,0 +1,55 @@
+"""
+JSON helpers
+============
+
+Thin wrappers that use orjson when it is installed and fall back to the
+standard library otherwise. Datetimes are written in ISO 8601, dataclasses
+as objects of their public fields and other values JSON cannot represent natively
+(paths, sets, ...) with ``str``.
+"""
+
+import json
+import dataclasses
+from datetime import date
+from typing import Any, Union
+
+
+def _default(obj: Any) -> Any:
+    """Encode a value JSON has no type for."""
+    if isinstance(obj, date):
+        return obj.isoformat()
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        # Like orjson, leave out private (underscore) fields
+        return {
+            f.name: getattr(obj, f.name) for f in dataclasses.fields(obj)
+            if not f.name.startswith("_")
+        }
+    return str(obj)
+
+
+try:
+    import orjson
+
+    loads = orjson.loads
+
+    def dumps(obj: Any) -> str:
+        """Serialize ``obj`` to a compact JSON string."""
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    def dumps_pretty(obj: Any) -> bytes:
+        """Serialize ``obj`` to UTF-8 JSON indented by two spaces."""
+        return orjson.dumps(
+            obj, default=_default, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+        )
+except ImportError:
+    def loads(data: Union[str, bytes]) -> Any:
+        """Parse a JSON document from text or UTF-8 bytes."""
+        return json.loads(data)
+
+    def dumps(obj: Any) -> str:
+        """Serialize ``obj`` to a compact JSON string."""
+        return json.dumps(obj, default=_default, separators=(",", ":"))
+
+    def dumps_pretty(obj: Any) -> bytes:
+        """Serialize ``obj`` to UTF-8 JSON indented by two spaces."""
+        return json.dumps(obj, default=_default, indent=2).encode("utf-8")
@@ -1,20 +1,283 @@
 from pathlib import Path
-from typing import Dict, Any, List, Optional, Callable
+from typing import Dict, Any, List, Optional, Callable, Iterator, Tuple, Union
+import re
+import math
 import time
+import atexit
+import random
+import asyncio
+import logging
+import hashlib
+import operator
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import httpx
 from google import genai
+from google.genai import errors as genai_errors
 from google.genai import types
+from . import _json
 from .config import Config
 from .conversation import ConversationManager
 from .logging_config import setup_logging, get_agent_logger
 from .tools.file_tools import (
     read_file, write_file, list_files, search_files,
-    create_file, delete_file, move_file, copy_file
+    create_file, delete_file, move_file, copy_file, file_hash
 )
 from .tools.system_tools import (
     run_command, get_system_info, manage_processes,
     schema_run_command, schema_get_system_info, schema_manage_processes
 )
 
+# Tool schemas are static, so they are built once at import and shared by
+# every Agent instance.
+
+# Map tool names to functions
+_TOOL_FUNCTIONS = {
+    # File tools
+    "read_file": read_file,
+    "write_file": write_file,
+    "list_files": list_files,
+    "search_files": search_files,
+    "create_file": create_file,
+    "delete_file": delete_file,
+    "move_file": move_file,
+    "copy_file": copy_file,
+    "file_hash": file_hash,
+    
+    # System tools
+    "run_command": run_command,
+    "get_system_info": get_system_info,
+    "manage_processes": manage_processes,
+}
+
+# Function declarations for file tools
+_FILE_TOOL_DECLARATIONS = [
+    types.FunctionDeclaration(
+        name="read_file",
+        description="Read file contents with safety checks",
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "file_path": types.Schema(type=types.Type.STRING, description="Path to the file"),
+                "encoding": types.Schema(type=types.Type.STRING, description="File encoding (default: utf-8)"),
+                "max_size": types.Schema(type=types.Type.INTEGER, description="Maximum file size to read in bytes")
+            },
+            required=["file_path"]
+        )
+    ),
+    types.FunctionDeclaration(
+        name="write_file",
+        description="Write content to a file with safety features",
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "file_path": types.Schema(type=types.Type.STRING, description="Path to the file"),
+                "content": types.Schema(type=types.Type.STRING, description="Content to write"),
+                "encoding": types.Schema(type=types.Type.STRING, description="File encoding (default: utf-8)"),
+                "create_dirs": types.Schema(type=types.Type.BOOLEAN, description="Create parent directories if needed"),
+                "backup": types.Schema(type=types.Type.BOOLEAN, description="Create backup of existing file (default: false)"),
+                "sync": types.Schema(type=types.Type.BOOLEAN, description="Flush the content to disk before returning (default: false)")
+            },
+            required=["file_path", "content"]
+        )
+    ),
+    types.FunctionDeclaration(
+        name="list_files",
+        description="List files in a directory with filtering options",
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "directory": types.Schema(type=types.Type.STRING, description="Directory path (default: current directory)"),
+                "pattern": types.Schema(type=types.Type.STRING, description="File pattern to match (default: *)"),
+                "recursive": types.Schema(type=types.Type.BOOLEAN, description="Search recursively"),
+                "include_hidden": types.Schema(type=types.Type.BOOLEAN, description="Include hidden files"),
+                "file_type": types.Schema(type=types.Type.STRING, description="Filter by type: file, dir, or link"),
+                "sort_by": types.Schema(type=types.Type.STRING, description="Sort by: name, size, or modified"),
+                "limit": types.Schema(type=types.Type.INTEGER, description="Maximum number of files to return")
+            },
+            required=[]
+        )
+    ),
+    types.FunctionDeclaration(
+        name="search_files",
+        description="Search for files by name and/or content, returning matching lines for content searches",
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "directory": types.Schema(type=types.Type.STRING, description="Directory to search in"),
+                "pattern": types.Schema(type=types.Type.STRING, description="Glob pattern file names must match (e.g., *.py)"),
+                "content_pattern": types.Schema(type=types.Type.STRING, description="Text to search for inside files"),
+                "name_pattern": types.Schema(type=types.Type.STRING, description="Text the file name must contain"),
+                "file_extensions": types.Schema(
+                    type=types.Type.ARRAY,
+                    items=types.Schema(type=types.Type.STRING),
+                    description="Only search files with these extensions (e.g., [\"py\", \"md\"])"
+                ),
+                "recursive": types.Schema(type=types.Type.BOOLEAN, description="Search subdirectories (default: true)"),
+                "case_sensitive": types.Schema(type=types.Type.BOOLEAN, description="Match case-sensitively (default: false)"),
+                "max_results": types.Schema(type=types.Type.INTEGER, description="Maximum number of files to return")
+            },
+            required=[]
+        )
+    ),
+    types.FunctionDeclaration(
+        name="file_hash",
+        description="Compute a checksum of a file, e.g. to check whether two files are identical",
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "file_path": types.Schema(type=types.Type.STRING, description="Path to the file"),
+                "algorithm": types.Schema(type=types.Type.STRING, description="Hash algorithm: sha256 (default), blake3, md5, sha1, ...")
+            },
+            required=["file_path"]
+        )
+    ),
+]
+
+# Gemini tools declaration
+_AVAILABLE_TOOLS = types.Tool(
+    function_declarations=[
+        *_FILE_TOOL_DECLARATIONS,
+        schema_run_command,
+        schema_get_system_info,
+        schema_manage_processes,
+    ]
+)
+
+
+# One client (and HTTP connection pool) per API key, shared by all agents
+_clients: Dict[str, genai.Client] = {}
+_clients_lock = threading.Lock()
+
+
+def _get_client(api_key: str) -> genai.Client:
+    """Return the shared Gemini client for an API key, creating it once."""
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = _clients[api_key] = genai.Client(api_key=api_key)
+        return client
+
+
+@atexit.register
+def _close_clients():
+    """Close shared clients at interpreter exit (agents never close them)."""
+    for client in _clients.values():
+        close = getattr(client, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+    _clients.clear()
+
+
+# Tools that change files or processes; these never run concurrently with
+# each other, while read-only tools in the same turn still overlap
+_SERIAL_TOOLS = frozenset({
+    "write_file", "create_file", "delete_file", "move_file", "copy_file",
+    "run_command", "manage_processes",
+})
+
+# Conversation roles -> Gemini API roles; anything else is dropped
+_ROLE_MAP = {"assistant": "model", "user": "user"}
+
+# History messages sent with a request; the window grows to twice this
+# before it is moved, see Agent._history_start
+_HISTORY_CONTEXT = 10
+
+# Sent in place of empty input. Contents are never mutated once built (the
+# generation loops only append to the message list), so one instance is shared.
+_FALLBACK_CONTENT = types.Content(role="user", parts=[types.Part(text="Hello")])
+
+INCOMPLETE_RESPONSE = "I couldn't generate a complete response. Please try rephrasing your request."
+
+
+class _Metrics:
+    """
+    Agent performance counters.
+    
+    Slotted for cheap attribute access. Updates that can come from tool
+    worker threads (function calls, the response-time mean) go through
+    ``lock``; everything else is only touched by the request thread.
+    """
+    
+    __slots__ = (
+        "total_requests",
+        "successful_requests",
+        "failed_requests",
+        "total_tokens",
+        "prompt_tokens",
+        "completion_tokens",
+        "function_calls",
+        "average_response_time",
+        "cache_hits",
+        "semantic_cache_hits",
+        "semantic_cache_misses",
+        "lock",
+    )
+    _FIELDS = __slots__[:-1]
+    
+    def __init__(self):
+        for name in self._FIELDS:
+            setattr(self, name, 0)
+        self.lock = threading.Lock()
+    
+    def record_success(self, elapsed_time: float):
+        """Count a successful request and fold its time into the running mean."""
+        with self.lock:
+            self.successful_requests += 1
+            self.average_response_time += (
+                (elapsed_time - self.average_response_time) / self.successful_requests
+            )
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the counters as a plain dict."""
+        with self.lock:
+            return {name: getattr(self, name) for name in self._FIELDS}
+
+
+# HTTP statuses worth retrying: timeouts, rate limits and transient server errors
+_RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Whether a failed model call may succeed if repeated."""
+    if isinstance(error, genai_errors.APIError):
+        return error.code in _RETRYABLE_STATUS
+    return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError))
+
+
+def _is_not_found(error: Exception) -> bool:
+    """Whether a model call failed because a referenced resource is gone."""
+    return isinstance(error, genai_errors.APIError) and error.code == 404
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Seconds requested by a Retry-After header on an API error, if any."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    value = headers.get("retry-after") if headers else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def _response_text(response: types.GenerateContentResponse) -> str:
+    """
+    Join the text parts of the first candidate.
+    
+    Reads the parts directly rather than through ``response.text``, which
+    re-validates the response and can raise on blocked or empty candidates.
+    """
+    if not response.candidates:
+        return ""
+    content = response.candidates[0].content
+    if not content or not content.parts:
+        return ""
+    return "".join(part.text for part in content.parts if part.text and not part.thought)
+
 
 class Agent:
     """
@@ -44,129 +307,68 @@ class Agent:
         )
         self.logger = self.logger_manager.get_logger()
         
-        # Initialize Gemini client
-        self.client = genai.Client(api_key=self.config.api_key)
+        # Initialize Gemini client (shared per API key)
+        self.client = _get_client(self.config.api_key)
         
         # Initialize conversation manager
         self.conversation = ConversationManager(
-            history_dir=self.config.data_dir / "history"
+            history_dir=self.config.data_dir / "history",
+            window_size=self.config.history_window,
+            persist=self.config.enable_history
         )
         
         # Setup available tools
         self._setup_tools()
         
         # Performance tracking
-        self.metrics = {
-            "total_requests": 0,
-            "successful_requests": 0,
-            "failed_requests": 0,
-            "total_tokens": 0,
-            "function_calls": 0,
-            "average_response_time": 0
-        }
+        self.metrics = _Metrics()
+        
+        # Worker pool for concurrent tool calls, created on first use
+        self._tool_executor: Optional[ThreadPoolExecutor] = None
+        self._serial_tool_lock = threading.Lock()
+        
+        # Write-behind session persistence, see _schedule_save
+        self._turns_since_save = 0
+        self._last_save_time = time.monotonic()
+        self._save_executor: Optional[ThreadPoolExecutor] = None
+        self._pending_save: Optional[Future] = None
+        
+        # Exact-match response cache (LRU), see _cache_key
+        self._response_cache: "OrderedDict[str, str]" = OrderedDict()
+        # Paraphrase cache: (scope, input) -> (unit embedding, response), see _semantic_cache_get
+        self._semantic_cache: "OrderedDict[Tuple[str, str], Tuple[List[float], str]]" = OrderedDict()
+        
+        # First history message sent to the model, see _history_start
+        self._history_session: Optional[str] = None
+        self._history_anchor = 0
+        
+        # Server-side cache of the system prompt and tools, see _cached_prefix
+        self._prefix_key: Optional[Tuple[str, str]] = None
+        self._prefix_name: Optional[str] = None
+        self._prefix_expires = 0.0
+        self._generate_config: Optional[types.GenerateContentConfig] = None
+        self._generate_config_key: Optional[tuple] = None
         
         self.logger.info("Agent initialized successfully")
     
     def _setup_tools(self):
         """Setup available tools and their schemas."""
-        # Map tool names to functions
-        self.tool_functions = {
-            # File tools
-            "read_file": read_file,
-            "write_file": write_file,
-            "list_files": list_files,
-            "search_files": search_files,
-            "create_file": create_file,
-            "delete_file": delete_file,
-            "move_file": move_file,
-            "copy_file": copy_file,
-            
-            # System tools
-            "run_command": run_command,
-            "get_system_info": get_system_info,
-            "manage_processes": manage_processes,
-        }
-        
-        # Create function declarations for file tools
-        file_tool_declarations = [
-            types.FunctionDeclaration(
-                name="read_file",
-                description="Read file contents with safety checks",
-                parameters=types.Schema(
-                    type=types.Type.OBJECT,
-                    properties={
-                        "file_path": types.Schema(type=types.Type.STRING, description="Path to the file"),
-                        "encoding": types.Schema(type=types.Type.STRING, description="File encoding (default: utf-8)"),
-                        "max_size": types.Schema(type=types.Type.INTEGER, description="Maximum file size to read in bytes")
-                    },
-                    required=["file_path"]
-                )
-            ),
-            types.FunctionDeclaration(
-                name="write_file",
-                description="Write content to a file with safety features",
-                parameters=types.Schema(
-                    type=types.Type.OBJECT,
-                    properties={
-                        "file_path": types.Schema(type=types.Type.STRING, description="Path to the file"),
-                        "content": types.Schema(type=types.Type.STRING, description="Content to write"),
-                        "encoding": types.Schema(type=types.Type.STRING, description="File encoding (default: utf-8)"),
-                        "create_dirs": types.Schema(type=types.Type.BOOLEAN, description="Create parent directories if needed"),
-                        "backup": types.Schema(type=types.Type.BOOLEAN, description="Create backup of existing file")
-                    },
-                    required=["file_path", "content"]
-                )
-            ),
-            types.FunctionDeclaration(
-                name="list_files",
-                description="List files in a directory with filtering options",
-                parameters=types.Schema(
-                    type=types.Type.OBJECT,
-                    properties={
-                        "directory": types.Schema(type=types.Type.STRING, description="Directory path (default: current directory)"),
-                        "pattern": types.Schema(type=types.Type.STRING, description="File pattern to match (default: *)"),
-                        "recursive": types.Schema(type=types.Type.BOOLEAN, description="Search recursively"),
-                        "include_hidden": types.Schema(type=types.Type.BOOLEAN, description="Include hidden files"),
-                        "file_type": types.Schema(type=types.Type.STRING, description="Filter by type: file, dir, or link"),
-                        "sort_by": types.Schema(type=types.Type.STRING, description="Sort by: name, size, or modified"),
-                        "limit": types.Schema(type=types.Type.INTEGER, description="Maximum number of files to return")
-                    },
-                    required=[]
-                )
-            ),
-            types.FunctionDeclaration(
-                name="search_files",
-                description="Search for files matching a pattern",
-                parameters=types.Schema(
-                    type=types.Type.OBJECT,
-                    properties={
-                        "directory": types.Schema(type=types.Type.STRING, description="Directory to search in"),
-                        "pattern": types.Schema(type=types.Type.STRING, description="File pattern to search for")
-                    },
-                    required=[]
-                )
-            ),
-        ]
-        
-        # Create Gemini tools declaration
-        self.available_tools = types.Tool(
-            function_declarations=[
-                *file_tool_declarations,
-                schema_run_command,
-                schema_get_system_info,
-                schema_manage_processes,
-            ]
-        )
+        # Per-instance copy so callers can register extra tools
+        self.tool_functions = dict(_TOOL_FUNCTIONS)
+        self.available_tools = _AVAILABLE_TOOLS
+        # Fixed for the agent's lifetime; used to render the system prompt
+        self._tool_names = tuple(self.tool_functions)
         
-        self.logger.debug(f"Loaded {len(self.tool_functions)} tools")
+        self.logger.debug("Loaded %d tools", len(self.tool_functions))
     
     
     def process_request(
         self,
         user_input: str,
         context: Optional[Dict[str, Any]] = None,
-        stream: bool = False
-    ) -> str:
+        stream: bool = False,
+        on_token: Optional[Callable[[str], None]] = None
+    ) -> Union[str, Iterator[str]]:
         """
         Process a user request.
         
@@ -174,192 +376,538 @@ class Agent:
             user_input: The user's input/question
             context: Additional context for the request
             stream: Whether to stream the response
+            on_token: Called with each chunk of text as it is generated;
+                the response is streamed and the full text still returned
         
         Returns:
-            The agent's response
+            The agent's response, or an iterator over its text chunks
+            when streaming
         """
+        if stream:
+            return self.process_request_stream(user_input, context)
+        if on_token is not None:
+            chunks = []
+            for text in self.process_request_stream(user_input, context):
+                on_token(text)
+                chunks.append(text)
+            return "".join(chunks)
+        
         start_time = time.time()
-        self.metrics["total_requests"] += 1
+        self.metrics.total_requests += 1
         
         try:
             # Add to conversation history (using 'assistant' for internal storage)
             self.conversation.add_message("user", user_input, metadata=context)
             
+            # Trivial or rejected input is answered without the model
+            response = self._fast_response(user_input)
+            if response is not None:
+                self.conversation.add_message("assistant", response)
+                self._record_success(user_input, response, start_time)
+                return response
+            
             # Get conversation context
             messages = self._prepare_messages(user_input)
             
-            # Generate response with retry logic
-            response = self._generate_with_retry(messages, stream)
+            cache_key = self._cache_key(messages)
+            response = self._cache_get(cache_key)
+            embedding = None
+            if response is None:
+                embedding, response = self._semantic_cache_get(user_input, context)
+            if response is not None:
+                self.conversation.add_message("assistant", response)
+            else:
+                # Generate response with retry logic
+                function_calls_before = self.metrics.function_calls
+                response = self._generate_with_retry(messages)
+                if self.metrics.function_calls == function_calls_before:
+                    self._cache_put(cache_key, response)
+                    self._semantic_cache_put(user_input, embedding, response)
             
-            # Update metrics
-            elapsed_time = time.time() - start_time
-            self._update_metrics(elapsed_time, success=True)
+            self._record_success(user_input, response, start_time)
+            return response
+        
+        except Exception as e:
+            return self._record_failure(user_input, e)
+    
+    def process_request_stream(
+        self,
+        user_input: str,
+        context: Optional[Dict[str, Any]] = None
+    ) -> Iterator[str]:
+        """
+        Process a user request, yielding response text as it is generated.
+        
+        Args:
+            user_input: The user's input/question
+            context: Additional context for the request
+        
+        Yields:
+            Chunks of the agent's response
+        """
+        start_time = time.time()
+        self.metrics.total_requests += 1
+        
+        try:
+            self.conversation.add_message("user", user_input, metadata=context)
             
-            # Log the interaction
-            self.logger_manager.log_conversation_turn("user", user_input)
-            self.logger_manager.log_conversation_turn("assistant", response)
+            response = self._fast_response(user_input)
+            if response is not None:
+                self.conversation.add_message("assistant", response)
+                yield response
+                self._record_success(user_input, response, start_time)
+                return
             
-            # Save conversation
-            if self.config.enable_history:
-                self.conversation.save_session(self.conversation.current_session)
+            messages = self._prepare_messages(user_input)
             
-            self.metrics["successful_requests"] += 1
-            return response
+            cache_key = self._cache_key(messages)
+            response = self._cache_get(cache_key)
+            embedding = None
+            if response is None:
+                embedding, response = self._semantic_cache_get(user_input, context)
+            if response is not None:
+                self.conversation.add_message("assistant", response)
+                yield response
+            else:
+                chunks = []
+                function_calls_before = self.metrics.function_calls
+                for text in self._generate_stream(messages):
+                    chunks.append(text)
+                    yield text
+                response = "".join(chunks)
+                if self.metrics.function_calls == function_calls_before:
+                    self._cache_put(cache_key, response)
+                    self._semantic_cache_put(user_input, embedding, response)
+            
+            self._record_success(user_input, response, start_time)
         
         except Exception as e:
-            self.metrics["failed_requests"] += 1
-            self.logger_manager.log_error(e, {"user_input": user_input})
+            yield self._record_failure(user_input, e)
+    
+    async def aprocess_request(
+        self,
+        user_input: str,
+        context: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """
+        Process a user request without blocking the event loop.
+        
+        Model calls go through the async client and tool calls run in worker
+        threads, so several requests can be in flight from one process.
+        
+        Args:
+            user_input: The user's input/question
+            context: Additional context for the request
+        
+        Returns:
+            The agent's response
+        """
+        start_time = time.time()
+        self.metrics.total_requests += 1
+        
+        try:
+            self.conversation.add_message("user", user_input, metadata=context)
+            
+            response = self._fast_response(user_input)
+            if response is not None:
+                self.conversation.add_message("assistant", response)
+                self._record_success(user_input, response, start_time)
+                return response
             
-            error_message = f"I encountered an error: {str(e)}. Please try again."
-            self.conversation.add_message("assistant", error_message,
-                                        metadata={"error": str(e)})
-            return error_message
+            messages = self._prepare_messages(user_input)
+            
+            cache_key = self._cache_key(messages)
+            response = self._cache_get(cache_key)
+            if response is None:
+                function_calls_before = self.metrics.function_calls
+                response = await self._agenerate_with_retry(messages)
+                if self.metrics.function_calls == function_calls_before:
+                    self._cache_put(cache_key, response)
+            if response != INCOMPLETE_RESPONSE:
+                self.conversation.add_message("assistant", response)
+            
+            self._record_success(user_input, response, start_time)
+            return response
+        
+        except Exception as e:
+            return self._record_failure(user_input, e)
     
-    def _prepare_messages(self, user_input: str) -> List[types.Content]:
-        """Prepare messages for the model."""
-        messages = []
+    async def aprocess_batch(self, user_inputs: List[str]) -> List[str]:
+        """
+        Answer several independent prompts concurrently.
         
-        # Add conversation context if enabled
-        if self.config.enable_history:
-            context_messages = self.conversation.get_context(max_messages=10)
-            # Convert conversation messages to proper format
-            for msg in context_messages:
-                try:
-                    # Check if it's already a Content object
-                    if isinstance(msg, types.Content):
-                        # Map roles to valid Gemini API roles
-                        if msg.role == "assistant":
-                            role = "model"
-                        elif msg.role == "user":
-                            role = "user"
-                        else:
-                            # Skip messages with invalid roles
-                            self.logger.warning(f"Skipping message with invalid role: {msg.role}")
-                            continue
-                        
-                        # Ensure parts exist and are not empty
-                        if msg.parts and len(msg.parts) > 0:
-                            # Check if parts have actual content
-                            valid_parts = []
-                            for part in msg.parts:
-                                if hasattr(part, 'text') and part.text and part.text.strip():
-                                    valid_parts.append(part)
-                                elif hasattr(part, 'function_response') and part.function_response:
-                                    valid_parts.append(part)
-                            
-                            if valid_parts:
-                                messages.append(
-                                    types.Content(
-                                        role=role,
-                                        parts=valid_parts
-                                    )
-                                )
-                        else:
-                            self.logger.warning("Skipping message with empty parts")
-                            
-                    elif isinstance(msg, dict):
-                        # Handle dictionary format
-                        msg_role = msg.get("role", "user")
-                        if msg_role == "assistant":
-                            role = "model"
-                        elif msg_role == "user":
-                            role = "user"
-                        else:
-                            # Skip messages with invalid roles
-                            self.logger.warning(f"Skipping message with invalid role: {msg_role}")
-                            continue
-                            
-                        content = msg.get("content", "")
-                        if content and str(content).strip():  # Only add non-empty messages
-                            messages.append(
-                                types.Content(
-                                    role=role,
-                                    parts=[types.Part(text=str(content).strip())]
-                                )
-                            )
-                    else:
-                        # Handle other formats - convert to string and assume user role
-                        content_str = str(msg).strip()
-                        if content_str:  # Only add non-empty messages
-                            messages.append(
-                                types.Content(
-                                    role="user",
-                                    parts=[types.Part(text=content_str)]
-                                )
-                            )
-                except Exception as e:
-                    self.logger.warning(f"Error processing message in history: {e}")
-                    continue
+        Each prompt is sent on its own, without conversation history, over
+        the shared async client with one request config. The turns are then
+        recorded in the session in input order.
         
-        # Add current user input - ensure it's not empty
-        user_input_stripped = user_input.strip()
-        if user_input_stripped:
-            messages.append(
-                types.Content(
-                    role="user",
-                    parts=[types.Part(text=user_input_stripped)]
-                )
-            )
-        else:
-            # Fallback for empty user input
-            messages.append(
-                types.Content(
-                    role="user",
-                    parts=[types.Part(text="Hello")]
-                )
+        Args:
+            user_inputs: Prompts to answer
+        
+        Returns:
+            Responses in the same order as the inputs
+        """
+        start_time = time.time()
+        generate_config = self._build_generate_config()
+        
+        results = await asyncio.gather(
+            *(
+                self._agenerate_with_retry([self._user_content(user_input)], generate_config)
+                for user_input in user_inputs
+            ),
+            return_exceptions=True
+        )
+        
+        responses = []
+        for user_input, result in zip(user_inputs, results):
+            self.metrics.total_requests += 1
+            self.conversation.add_message("user", user_input)
+            if isinstance(result, Exception):
+                responses.append(self._record_failure(user_input, result))
+                continue
+            if result != INCOMPLETE_RESPONSE:
+                self.conversation.add_message("assistant", result)
+            self._record_success(user_input, result, start_time)
+            responses.append(result)
+        return responses
+    
+    def _fast_response(self, user_input: str) -> Optional[str]:
+        """
+        Answer input that does not need the model, or None to call it.
+        
+        Handles empty input, input over ``config.max_input_chars`` and
+        matches of ``config.blocked_patterns``.
+        """
+        text = user_input.strip()
+        if not text:
+            return "Please enter a question or request."
+        
+        if len(text) > self.config.max_input_chars:
+            self.logger.info("Rejected input of %d characters without a model call", len(text))
+            return (
+                f"Your input is too long ({len(text):,} characters; the limit is "
+                f"{self.config.max_input_chars:,}). Please shorten it or attach it with --file."
             )
         
-        # Final validation: ensure all messages have valid parts
-        validated_messages = []
+        for pattern in self.config.blocked_patterns:
+            if re.search(pattern, text, re.IGNORECASE):
+                self.logger.info("Rejected input matching blocked pattern %r", pattern)
+                return "I can't help with that request."
+        
+        return None
+    
+    def _cache_key(self, messages: List[types.Content]) -> Optional[str]:
+        """
+        Key a request by everything that determines the model's answer.
+        
+        Returns None when caching is disabled or the conversation is too
+        long for an exact match to be a meaningful reuse.
+        """
+        if not self.config.enable_cache or len(messages) > self.config.cache_history_threshold:
+            return None
+        
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{self.config.model.value}\0{self.config.temperature}\0".encode("utf-8"))
+        h.update(self.config.get_system_prompt(self._tool_names).encode("utf-8"))
         for msg in messages:
-            if msg.parts and len(msg.parts) > 0:
-                # Double-check that at least one part has content
-                has_valid_content = False
-                for part in msg.parts:
-                    if (hasattr(part, 'text') and part.text and part.text.strip()) or \
-                       (hasattr(part, 'function_response') and part.function_response):
-                        has_valid_content = True
-                        break
-                
-                if has_valid_content:
-                    validated_messages.append(msg)
-                else:
-                    self.logger.warning(f"Skipping message with role '{msg.role}' - no valid content in parts")
-            else:
-                self.logger.warning(f"Skipping message with role '{msg.role}' - empty or missing parts")
-        
-        # Ensure we have at least one message
-        if not validated_messages:
-            validated_messages = [
-                types.Content(
-                    role="user",
-                    parts=[types.Part(text=user_input_stripped or "Hello")]
-                )
-            ]
+            h.update(b"\0")
+            h.update(msg.model_dump_json(exclude_none=True).encode("utf-8"))
+        return h.hexdigest()
+    
+    def _cache_get(self, key: Optional[str]) -> Optional[str]:
+        """Return a cached response and mark it recently used."""
+        if key is None or key not in self._response_cache:
+            return None
+        self._response_cache.move_to_end(key)
+        self.metrics.cache_hits += 1
+        self.logger.debug("Response cache hit: %s", key)
+        return self._response_cache[key]
+    
+    def _cache_put(self, key: Optional[str], response: str):
+        """Cache a response, evicting the least recently used entry when full."""
+        if key is None or not response or response == INCOMPLETE_RESPONSE:
+            return
+        self._response_cache[key] = response
+        self._response_cache.move_to_end(key)
+        while len(self._response_cache) > self.config.cache_size:
+            self._response_cache.popitem(last=False)
+    
+    def _semantic_scope(self) -> str:
+        """Key the configuration a paraphrased answer is valid for."""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{self.config.model.value}\0".encode("utf-8"))
+        # The system prompt also carries the working directory
+        h.update(self.config.get_system_prompt(self._tool_names).encode("utf-8"))
+        return h.hexdigest()
+    
+    def _semantic_cache_get(
+        self,
+        user_input: str,
+        context: Optional[Dict[str, Any]]
+    ) -> Tuple[Optional[List[float]], Optional[str]]:
+        """
+        Look up an earlier answer to a paraphrase of ``user_input``.
+        
+        Only used for deterministic (temperature 0), history-free requests
+        without extra context, where a close paraphrase can safely share
+        an answer, and only matched against answers given under the same
+        model and system prompt. Off unless ``semantic_cache_size`` is set,
+        as every eligible request first waits for an embedding call.
+        
+        Returns:
+            The normalized input embedding (None when not applicable) and
+            the cached response, if one is similar enough
+        """
+        if not self.config.enable_cache or self.config.semantic_cache_size <= 0:
+            return None, None
+        if self.config.temperature != 0 or context:
+            return None, None
+        session = self.conversation.current_session
+        if self.config.enable_history and session and session.message_count > 1:
+            return None, None
+        
+        try:
+            result = self.client.models.embed_content(
+                model=self.config.embedding_model,
+                contents=user_input
+            )
+            values = result.embeddings[0].values
+        except Exception as e:
+            self.logger.debug("Embedding failed, skipping semantic cache: %s", e)
+            return None, None
+        
+        norm = math.sqrt(sum(v * v for v in values)) or 1.0
+        embedding = [v / norm for v in values]
+        
+        scope = self._semantic_scope()
+        best_key, best_score = None, self.config.semantic_cache_threshold
+        for key, (cached_embedding, _) in self._semantic_cache.items():
+            if key[0] != scope:
+                continue
+            score = sum(map(operator.mul, embedding, cached_embedding))
+            if score >= best_score:
+                best_key, best_score = key, score
+        
+        if best_key is None:
+            self.metrics.semantic_cache_misses += 1
+            return embedding, None
+        
+        self.metrics.semantic_cache_hits += 1
+        self._semantic_cache.move_to_end(best_key)
+        self.logger.debug("Semantic cache hit (similarity %.3f)", best_score)
+        return embedding, self._semantic_cache[best_key][1]
+    
+    def _semantic_cache_put(self, user_input: str, embedding: Optional[List[float]], response: str):
+        """Remember a response under its prompt embedding (LRU-bounded)."""
+        if embedding is None or not response or response == INCOMPLETE_RESPONSE:
+            return
+        key = (self._semantic_scope(), user_input)
+        self._semantic_cache[key] = (embedding, response)
+        self._semantic_cache.move_to_end(key)
+        while len(self._semantic_cache) > self.config.semantic_cache_size:
+            self._semantic_cache.popitem(last=False)
+    
+    def _record_success(self, user_input: str, response: str, start_time: float):
+        """Update metrics, log and persist a completed request."""
+        # Update metrics
+        elapsed_time = time.time() - start_time
+        self._update_metrics(elapsed_time)
+        
+        # Log the interaction
+        self.logger_manager.log_conversation_turn("user", user_input)
+        self.logger_manager.log_conversation_turn("assistant", response)
+        
+        # Save conversation (written behind the request, every few turns)
+        if self.config.enable_history:
+            self._schedule_save()
+        
+    
+    def _schedule_save(self):
+        """
+        Queue a background save of the current session.
+        
+        Saves happen every ``config.save_every_turns`` turns, or sooner once
+        ``config.save_interval`` seconds have passed since the last one.
+        """
+        self._turns_since_save += 1
+        now = time.monotonic()
+        if (
+            self._turns_since_save < self.config.save_every_turns
+            and now - self._last_save_time < self.config.save_interval
+        ):
+            return
+        self._turns_since_save = 0
+        self._last_save_time = now
+        
+        # A save still waiting in the queue snapshots the session when it
+        # runs, so it already covers this turn
+        pending = self._pending_save
+        if pending is not None and not pending.running() and not pending.done():
+            return
+        
+        if self._save_executor is None:
+            # One worker keeps saves ordered
+            self._save_executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="session-save"
+            )
+        self._pending_save = self._save_executor.submit(
+            self.conversation.save_session, self.conversation.current_session
+        )
+        self._pending_save.add_done_callback(self._log_save_error)
+    
+    def _log_save_error(self, future):
+        """Report a failed background save."""
+        error = future.exception()
+        if error:
+            self.logger_manager.log_error(error, {"operation": "save_session"})
+    
+    def flush_session(self):
+        """Wait for queued saves and persist the current session now."""
+        if self._save_executor is not None:
+            self._save_executor.shutdown(wait=True)
+            self._save_executor = None
+            self._pending_save = None
+        
+        if self.config.enable_history and self.conversation.current_session:
+            self.conversation.save_session(self.conversation.current_session)
+        self._turns_since_save = 0
+    
+    def reset_session(self):
+        """Persist the current session and start a new one."""
+        self.flush_session()
+        self.conversation.create_session()
+    
+    def _record_failure(self, user_input: str, error: Exception) -> str:
+        """Record a failed request and return the user-facing error message."""
+        self.metrics.failed_requests += 1
+        self.logger_manager.log_error(error, {"user_input": user_input})
+        
+        error_message = f"I encountered an error: {str(error)}. Please try again."
+        self.conversation.add_message("assistant", error_message,
+                                    metadata={"error": str(error)})
+        return error_message
+    
+    def _prepare_messages(self, user_input: str) -> List[types.Content]:
+        """Prepare messages for the model."""
+        context_messages = (
+            self.conversation.get_context(start=self._history_start())
+            if self.config.enable_history else []
+        )
+        messages = list(self._iter_validated_contents(context_messages))
+        
+        # The caller has already added this input to the history, which then
+        # ends with it; only send it separately when history is off
+        session = self.conversation.current_session
+        last = session.messages[-1] if context_messages and session.messages else None
+        if last is None or last.role != "user" or last.content != user_input:
+            messages.append(self._user_content(user_input))
         
         # Debug: Log message info for troubleshooting
-        message_info = [(msg.role, len(msg.parts), bool(msg.parts[0].text if msg.parts else False)) for msg in validated_messages]
-        self.logger.debug(f"Validated {len(validated_messages)} messages: {message_info}")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            message_info = [(msg.role, len(msg.parts), bool(msg.parts[0].text)) for msg in messages]
+            self.logger.debug("Validated %d messages: %s", len(messages), message_info)
         
-        return validated_messages
+        return messages
     
-    def _generate_with_retry(
-        self,
-        messages: List[types.Content],
-        stream: bool = False
-    ) -> str:
+    def _history_start(self) -> int:
+        """
+        Session-wide index of the first history message to send.
+        
+        A sliding window of the last N messages changes the start of the
+        prompt on every turn, so the model provider can never reuse its
+        cached prefix. Instead the window start stays put while the history
+        grows to twice the window, then jumps forward to the last N
+        messages; between jumps each request extends the previous one.
+        """
+        session = self.conversation.current_session
+        if session is None:
+            return 0
+        total = session.message_count
+        if session.session_id != self._history_session:
+            self._history_session = session.session_id
+            self._history_anchor = max(total - _HISTORY_CONTEXT, 0)
+        elif total - self._history_anchor > 2 * _HISTORY_CONTEXT:
+            self._history_anchor = total - _HISTORY_CONTEXT
+        return self._history_anchor
+    
+    def _user_content(self, user_input: str) -> types.Content:
+        """Wrap user input as a Gemini content, substituting a greeting if empty."""
+        user_input_stripped = user_input.strip()
+        if not user_input_stripped:
+            return _FALLBACK_CONTENT
+        return types.Content(
+            role="user",
+            parts=[types.Part(text=user_input_stripped)]
+        )
+    
+    def _iter_validated_contents(self, context_messages: List[Any]) -> Iterator[types.Content]:
+        """
+        Convert history entries to Gemini contents in a single pass.
+        
+        Only messages with a valid role and at least one non-empty part are
+        yielded, so the result needs no further validation.
+        """
+        # Local bindings keep module/attribute lookups out of the loop
+        map_role = _ROLE_MAP.get
+        Content = types.Content
+        Part = types.Part
+        warning = self.logger.warning
+        
+        for msg in context_messages:
+            try:
+                # Check if it's already a Content object
+                if isinstance(msg, Content):
+                    role = map_role(msg.role)
+                    if role is None:
+                        warning(f"Skipping message with invalid role: {msg.role}")
+                        continue
+                    
+                    valid_parts = [
+                        part for part in msg.parts or ()
+                        if ((text := part.text) and text.strip()) or part.function_response
+                    ]
+                    if valid_parts and role == msg.role and len(valid_parts) == len(msg.parts):
+                        # Already valid: pass the history's shared object through
+                        yield msg
+                    elif valid_parts:
+                        yield Content(role=role, parts=valid_parts)
+                    else:
+                        warning("Skipping message with empty parts")
+                
+                elif isinstance(msg, dict):
+                    # Handle dictionary format
+                    msg_role = msg.get("role", "user")
+                    role = map_role(msg_role)
+                    if role is None:
+                        warning(f"Skipping message with invalid role: {msg_role}")
+                        continue
+                    
+                    content = str(msg.get("content") or "").strip()
+                    if content:  # Only add non-empty messages
+                        yield Content(role=role, parts=[Part(text=content)])
+                
+                else:
+                    # Handle other formats - convert to string and assume user role
+                    content_str = str(msg).strip()
+                    if content_str:  # Only add non-empty messages
+                        yield Content(role="user", parts=[Part(text=content_str)])
+            
+            except Exception as e:
+                warning(f"Error processing message in history: {e}")
+    
+    def _generate_with_retry(self, messages: List[types.Content]) -> str:
         """
         Generate response with retry logic and tool handling.
         
         Args:
             messages: Conversation messages
-            stream: Whether to stream the response
         
         Returns:
             Generated response text
         """
         max_iterations = self.config.max_iterations
         retry_attempts = self.config.retry_attempts
+        # Settings cannot change mid-turn, so build the request config once
+        generate_config = self._build_generate_config()
         
         for iteration in range(max_iterations):
             for attempt in range(retry_attempts):
@@ -368,22 +916,11 @@ class Agent:
                     response = self.client.models.generate_content(
                         model=self.config.model.value,
                         contents=messages,
-                        config=types.GenerateContentConfig(
-                            tools=[self.available_tools],
-                            system_instruction=self.config.get_system_prompt(
-                                list(self.tool_functions.keys())
-                            ),
-                            temperature=self.config.temperature,
-                            max_output_tokens=self.config.max_tokens
-                        )
+                        config=generate_config
                     )
                     
                     # Log token usage
-                    if response.usage_metadata:
-                        self.metrics["total_tokens"] += (
-                            response.usage_metadata.prompt_token_count or 0 +
-                            response.usage_metadata.candidates_token_count or 0
-                        )
+                    self._record_usage(response.usage_metadata)
                     
                     # Add the model's response to the conversation
                     for candidate in response.candidates:
@@ -402,18 +939,17 @@ class Agent:
                                 self.logger.info(f"Function executed successfully: {function_responses[0].function_response.name}")
                                 messages.append(types.Content(role="user", parts=function_responses))
                         
+                        self._trim_context(messages, response.usage_metadata)
+                        
                         # Continue to next iteration for more processing
                         continue
                     else:
                         # No function calls, check if we have a final text response
-                        try:
-                            if response.text:
-                                # Add to conversation history
-                                self.conversation.add_message("assistant", response.text)
-                                return response.text
-                        except Exception:
-                            # response.text might raise an exception in some cases
-                            pass
+                        text = _response_text(response)
+                        if text:
+                            # Add to conversation history
+                            self.conversation.add_message("assistant", text)
+                            return text
                     
                     break  # Exit retry loop if successful
                 
@@ -422,125 +958,469 @@ class Agent:
                     
                     # Log detailed error information for debugging
                     if "parts field" in str(e).lower():
-                        self.logger.error("Parts validation error detected. Current messages:")
-                        for i, msg in enumerate(messages):
-                            parts_count = len(msg.parts) if msg.parts else 0
-                            self.logger.error(f"  Message {i}: role={msg.role}, parts_count={parts_count}")
-                            if msg.parts:
-                                for j, part in enumerate(msg.parts):
-                                    has_text = hasattr(part, 'text') and bool(part.text)
-                                    has_func_resp = hasattr(part, 'function_response') and bool(part.function_response)
-                                    self.logger.error(f"    Part {j}: text={has_text}, func_resp={has_func_resp}")
+                        self.logger.error(
+                            "Parts validation error detected. Current messages:\n%s",
+                            "\n".join(
+                                f"  Message {i}: role={msg.role}, parts_count={len(msg.parts or ())}"
+                                + "".join(
+                                    f"\n    Part {j}: text={bool(part.text)}, "
+                                    f"func_resp={bool(part.function_response)}"
+                                    for j, part in enumerate(msg.parts or ())
+                                )
+                                for i, msg in enumerate(messages)
+                            )
+                        )
                     
-                    if attempt < retry_attempts - 1:
-                        time.sleep(self.config.retry_delay * (attempt + 1))
+                    if generate_config.cached_content and _is_not_found(e):
+                        # The cached prefix expired server-side; rebuild it and retry
+                        self._drop_cached_prefix()
+                        generate_config = self._build_generate_config()
+                    elif attempt < retry_attempts - 1 and _is_retryable(e):
+                        time.sleep(self._backoff_delay(attempt, e))
                     else:
                         raise
 
         # If we reach here, no final response was generated
-        return "I couldn't generate a complete response. Please try rephrasing your request."
+        return INCOMPLETE_RESPONSE
     
-    def _handle_function_calls(
+    async def _agenerate_with_retry(
         self,
-        function_calls: List[Any]
-    ) -> List[types.Part]:
+        messages: List[types.Content],
+        generate_config: Optional[types.GenerateContentConfig] = None
+    ) -> str:
         """
-        Handle function calls from the model.
+        Async counterpart of _generate_with_retry.
+        
+        Unlike the sync path this does not record the answer in the
+        conversation; callers do, so concurrent turns land in order.
         
         Args:
-            function_calls: List of function calls from the model
+            messages: Conversation messages
+            generate_config: Request config to reuse (built if not given)
         
         Returns:
-            List of function response parts
+            Generated response text
         """
-        function_responses = []
+        generate_config = generate_config or self._build_generate_config()
         
-        for function_call_part in function_calls:
-            self.metrics["function_calls"] += 1
+        for iteration in range(self.config.max_iterations):
+            response = await self._agenerate_content(messages, generate_config)
             
-            function_name = function_call_part.name
-            function_args = dict(function_call_part.args)
+            self._record_usage(response.usage_metadata)
             
-            self.logger.info(f"Executing function: {function_name} fuction with args: {function_args}")
+            for candidate in response.candidates or []:
+                if candidate.content:
+                    messages.append(types.Content(role="model", parts=candidate.content.parts))
             
-            # Execute function
-            start_time = time.time()
+            if response.function_calls:
+                function_responses = await self._ahandle_function_calls(response.function_calls)
+                messages.append(types.Content(role="user", parts=function_responses))
+                self._trim_context(messages, response.usage_metadata)
+                continue
             
-            if function_name in self.tool_functions:
+            text = _response_text(response)
+            if text:
+                return text
+            break
+        
+        return INCOMPLETE_RESPONSE
+    
+    async def _agenerate_content(
+        self,
+        messages: List[types.Content],
+        generate_config: types.GenerateContentConfig
+    ) -> types.GenerateContentResponse:
+        """Call the async model API, retrying with backoff on failure."""
+        retry_attempts = self.config.retry_attempts
+        
+        for attempt in range(retry_attempts):
+            try:
+                return await self.client.aio.models.generate_content(
+                    model=self.config.model.value,
+                    contents=messages,
+                    config=generate_config
+                )
+            except Exception as e:
+                self.logger.warning(f"Attempt {attempt + 1} failed: {e}")
+                if generate_config.cached_content and _is_not_found(e):
+                    self._drop_cached_prefix()
+                    generate_config = self._build_generate_config()
+                elif attempt < retry_attempts - 1 and _is_retryable(e):
+                    await asyncio.sleep(self._backoff_delay(attempt, e))
+                else:
+                    raise
+    
+    async def _ahandle_function_calls(self, function_calls: List[Any]) -> List[types.Part]:
+        """Run function calls in worker threads, keeping the model's order."""
+        return list(await asyncio.gather(*(
+            asyncio.to_thread(self._execute_function_call, function_call_part)
+            for function_call_part in function_calls
+        )))
+    
+    def _generate_stream(self, messages: List[types.Content]) -> Iterator[str]:
+        """
+        Stream a response, running tool calls between model turns.
+        
+        Args:
+            messages: Conversation messages
+        
+        Yields:
+            Response text as it arrives from the model
+        """
+        retry_attempts = self.config.retry_attempts
+        generate_config = self._build_generate_config()
+        
+        for iteration in range(self.config.max_iterations):
+            for attempt in range(retry_attempts):
+                parts = []
+                function_calls = []
+                texts = []
+                usage = None
+                
                 try:
-                    result = self.tool_functions[function_name](**function_args)
-                    
-                    # Create function response part (similar to your reference code)
-                    function_response_part = types.Part(
-                        function_response=types.FunctionResponse(
-                            name=function_name,
-                            response={"result": str(result)}
-                        )
-                    )
-                    function_responses.append(function_response_part)
-                    
+                    for chunk in self.client.models.generate_content_stream(
+                        model=self.config.model.value,
+                        contents=messages,
+                        config=generate_config
+                    ):
+                        if chunk.usage_metadata:
+                            usage = chunk.usage_metadata
+                        if chunk.function_calls:
+                            function_calls.extend(chunk.function_calls)
+                        for candidate in chunk.candidates or []:
+                            if not candidate.content or not candidate.content.parts:
+                                continue
+                            for part in candidate.content.parts:
+                                parts.append(part)
+                                if part.text:
+                                    texts.append(part.text)
+                                    yield part.text
+                    break
+                
                 except Exception as e:
-                    self.logger.error(f"Error executing function {function_name}: {e}")
-                    # Create error response
-                    function_response_part = types.Part(
-                        function_response=types.FunctionResponse(
-                            name=function_name,
-                            response={"error": f"Error executing function {function_name}: {e}"}
-                        )
-                    )
-                    function_responses.append(function_response_part)
-            else:
-                error_message = f"Function {function_name} not found."
-                self.logger.warning(error_message)
-                # Create error response
-                function_response_part = types.Part(
-                    function_response=types.FunctionResponse(
-                        name=function_name,
-                        response={"error": error_message}
-                    )
-                )
-                function_responses.append(function_response_part)
+                    # Text already handed to the caller cannot be taken back,
+                    # so only a stream that failed before any is retried
+                    if texts:
+                        raise
+                    self.logger.warning(f"Attempt {attempt + 1} failed: {e}")
+                    if generate_config.cached_content and _is_not_found(e):
+                        # The cached prefix expired server-side; rebuild it and retry
+                        self._drop_cached_prefix()
+                        generate_config = self._build_generate_config()
+                    elif attempt < retry_attempts - 1 and _is_retryable(e):
+                        time.sleep(self._backoff_delay(attempt, e))
+                    else:
+                        raise
+            
+            # Streams report cumulative usage; the last chunk has the totals
+            self._record_usage(usage)
             
-            elapsed_time = time.time() - start_time
-            self.logger.debug(f"Function {function_name} executed in {elapsed_time:.4f}s")
-        
-        return function_responses
-    
-    def _update_metrics(self, elapsed_time: float, success: bool = True):
-        """Update performance metrics."""
-        if success:
-            # Update average response time
-            total_successful = self.metrics["successful_requests"] + 1
-            current_avg = self.metrics["average_response_time"]
-            self.metrics["average_response_time"] = (
-                (current_avg * (total_successful - 1) + elapsed_time) / total_successful
+            if parts:
+                messages.append(types.Content(role="model", parts=parts))
+            
+            if function_calls:
+                function_responses = self._handle_function_calls(function_calls)
+                if function_responses:
+                    messages.append(types.Content(role="user", parts=function_responses))
+                self._trim_context(messages, usage)
+                continue
+            
+            if texts:
+                self.conversation.add_message("assistant", "".join(texts))
+                return
+            break
+        
+        yield INCOMPLETE_RESPONSE
+    
+    def _build_generate_config(self) -> types.GenerateContentConfig:
+        """
+        Return the generation config for the current settings.
+        
+        The config is rebuilt only when a setting it depends on changes
+        (e.g. via the CLI's /model or /temperature commands); otherwise the
+        validated object from the previous turn is reused.
+        """
+        cached_content = self._cached_prefix()
+        system_prompt = None if cached_content else self.config.get_system_prompt(self._tool_names)
+        key = (cached_content, system_prompt, self.config.temperature, self.config.max_tokens)
+        if self._generate_config is not None and key == self._generate_config_key:
+            return self._generate_config
+        
+        if cached_content:
+            generate_config = types.GenerateContentConfig(
+                cached_content=cached_content,
+                temperature=self.config.temperature,
+                max_output_tokens=self.config.max_tokens
+            )
+        else:
+            generate_config = types.GenerateContentConfig(
+                tools=[self.available_tools],
+                system_instruction=system_prompt,
+                temperature=self.config.temperature,
+                max_output_tokens=self.config.max_tokens
+            )
+        self._generate_config, self._generate_config_key = generate_config, key
+        return generate_config
+    
+    def _cached_prefix(self) -> Optional[str]:
+        """
+        Name of a server-side cache holding the system prompt and tools.
+        
+        The static prefix is uploaded once per model and prompt and then
+        referenced by name, so it is not re-sent and re-processed on every
+        call. The cache is re-created shortly before its TTL runs out, or
+        when the model or prompt changes. Returns None when disabled or
+        when the API refused to cache the prefix (e.g. it is below the
+        model's minimum cacheable size); requests then carry it inline.
+        """
+        ttl = self.config.context_cache_ttl
+        if ttl <= 0:
+            return None
+        
+        system_prompt = self.config.get_system_prompt(self._tool_names)
+        key = (self.config.model.value, system_prompt)
+        if key == self._prefix_key and (
+            self._prefix_name is None or time.monotonic() < self._prefix_expires
+        ):
+            return self._prefix_name
+        
+        self._drop_cached_prefix()
+        self._prefix_key = key
+        try:
+            cached = self.client.caches.create(
+                model=self.config.model.value,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=system_prompt,
+                    tools=[self.available_tools],
+                    ttl=f"{ttl}s"
+                )
+            )
+        except Exception as e:
+            self.logger.info("Prompt prefix not cached, sending it inline: %s", e)
+            return None
+        
+        self._prefix_name = cached.name
+        # Renew a little early so in-flight requests never hit an expired cache
+        self._prefix_expires = time.monotonic() + ttl * 0.9
+        return self._prefix_name
+    
+    def _drop_cached_prefix(self):
+        """Forget the server-side prefix cache, deleting it if it still exists."""
+        name, self._prefix_key, self._prefix_name = self._prefix_name, None, None
+        if name:
+            try:
+                self.client.caches.delete(name=name)
+            except Exception as e:
+                self.logger.debug("Could not delete cached content %s: %s", name, e)
+    
+    def _handle_function_calls(
+        self,
+        function_calls: List[Any]
+    ) -> List[types.Part]:
+        """
+        Handle function calls from the model.
+        
+        Args:
+            function_calls: List of function calls from the model
+        
+        Returns:
+            List of function response parts
+        """
+        if len(function_calls) == 1:
+            return [self._execute_function_call(function_calls[0])]
+        
+        if self._tool_executor is None:
+            self._tool_executor = ThreadPoolExecutor(
+                max_workers=8, thread_name_prefix="tool"
             )
+        
+        # Independent calls run concurrently; map() keeps the model's order
+        return list(self._tool_executor.map(self._execute_function_call, function_calls))
+    
+    def _execute_function_call(self, function_call_part: Any) -> types.Part:
+        """
+        Execute a single function call.
+        
+        Args:
+            function_call_part: Function call from the model
+        
+        Returns:
+            Function response part (an error response if the call failed)
+        """
+        with self.metrics.lock:
+            self.metrics.function_calls += 1
+        
+        logger = self.logger
+        function_name = function_call_part.name
+        # args is a plain dict in google.genai (None for no-argument calls);
+        # ** unpacking copies it anyway, so it is passed through as is
+        function_args = function_call_part.args or {}
+        
+        logger.info("Executing function: %s with args: %s", function_name, function_args)
+        
+        # Execute function
+        start_time = time.perf_counter()
+        
+        function = self.tool_functions.get(function_name)
+        if function is None:
+            error_message = f"Function {function_name} not found."
+            logger.warning(error_message)
+            response = {"error": error_message}
+        else:
+            try:
+                if function_name in _SERIAL_TOOLS:
+                    # Side-effecting tools run one at a time
+                    with self._serial_tool_lock:
+                        result = function(**function_args)
+                else:
+                    result = function(**function_args)
+                # Structured results go to the model as JSON, not Python repr
+                response = {
+                    "result": _json.dumps(result)
+                    if isinstance(result, (dict, list)) else str(result)
+                }
+            except Exception as e:
+                logger.error(f"Error executing function {function_name}: {e}")
+                response = {"error": f"Error executing function {function_name}: {e}"}
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Function %s executed in %.4fs", function_name, time.perf_counter() - start_time
+            )
+        
+        return types.Part(
+            function_response=types.FunctionResponse(
+                name=function_name,
+                response=response
+            )
+        )
+    
+    def _record_usage(self, usage_metadata: Optional[types.GenerateContentResponseUsageMetadata]):
+        """Add a response's token usage to the metrics."""
+        if not usage_metadata:
+            return
+        prompt_tokens = usage_metadata.prompt_token_count or 0
+        completion_tokens = usage_metadata.candidates_token_count or 0
+        self.metrics.prompt_tokens += prompt_tokens
+        self.metrics.completion_tokens += completion_tokens
+        self.metrics.total_tokens += prompt_tokens + completion_tokens
+    
+    def _trim_context(
+        self,
+        messages: List[types.Content],
+        usage_metadata: Optional[types.GenerateContentResponseUsageMetadata]
+    ):
+        """
+        Drop the oldest messages once the prompt outgrows ``config.max_context_tokens``.
+        
+        Every tool round re-sends the whole conversation, so without a cap a
+        long multi-step turn grows its prompt without bound. The last
+        response's prompt size (minus any cached prefix) is spread over the
+        messages by serialized length to estimate what to drop. Earlier
+        turns go first, then the oldest tool rounds of the current turn.
+        The current user message and the latest tool round are always kept,
+        and call/response pairs are only removed together.
+        """
+        budget = self.config.max_context_tokens
+        if not budget or not usage_metadata:
+            return
+        prompt_tokens = (usage_metadata.prompt_token_count or 0) - (
+            usage_metadata.cached_content_token_count or 0
+        )
+        if prompt_tokens <= budget:
+            return
+        
+        sizes = [len(msg.model_dump_json(exclude_none=True)) for msg in messages]
+        excess = (prompt_tokens - budget) * sum(sizes) / prompt_tokens
+        
+        # Index of the current user message (not a tool response)
+        current = max(
+            (i for i, msg in enumerate(messages)
+             if msg.role == "user" and not any(p.function_response for p in msg.parts or ())),
+            default=0
+        )
+        
+        start = 0
+        while excess > 0 and start < current:
+            excess -= sizes[start]
+            start += 1
+        # Resume at a user message so the history still opens with one
+        while start < current and messages[start].role != "user":
+            start += 1
+        
+        # Oldest model-call / tool-response pairs of this turn, keeping the last
+        end = current + 1
+        while (
+            excess > 0 and end + 3 < len(messages)
+            and messages[end].role == "model" and messages[end + 1].role == "user"
+        ):
+            excess -= sizes[end] + sizes[end + 1]
+            end += 2
+        
+        if end > current + 1:
+            del messages[current + 1:end]
+        if start:
+            del messages[:start]
+        self.logger.debug(
+            "Trimmed context to %d messages (prompt was %d tokens)", len(messages), prompt_tokens
+        )
+    
+    def _backoff_delay(self, attempt: int, error: Exception) -> float:
+        """Seconds to wait before the next attempt: Retry-After, else jittered exponential."""
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.config.retry_max_delay)
+        delay = min(self.config.retry_max_delay, self.config.retry_delay * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.5)
+    
+    def _update_metrics(self, elapsed_time: float):
+        """Update performance metrics for a successful request."""
+        self.metrics.record_success(elapsed_time)
     
     def get_metrics(self) -> Dict[str, Any]:
         """Get performance metrics."""
-        return self.metrics
+        return self.metrics.snapshot()
     
     def export_session(self, session_id: str, format: str = "json") -> str:
         """Export a specific session in the given format."""
         return self.conversation.export_session(session_id, format=format)
     
     def search_history(self, query: str) -> List[Dict[str, Any]]:
-        """Search conversation history for a specific query."""
-        return self.conversation.search(query)
+        """
+        Search conversation history for a specific query.
+        
+        Returns:
+            One dict per matching session, most recent first, with its
+            ``session_id``, ``summary`` and ``messages_count``
+        """
+        return [
+            {
+                "session_id": session.session_id,
+                "summary": session.summarize(),
+                "messages_count": session.message_count,
+            }
+            for session in self.conversation.search_sessions(query)
+        ]
     
     def cleanup(self):
         """Clean up resources and save any pending data."""
         try:
-            # Save current conversation session if history is enabled
-            if self.config.enable_history and hasattr(self.conversation, 'current_session'):
-                self.conversation.save_session(self.conversation.current_session)
+            # Drain pending writes and save the current session
+            self.flush_session()
+            self.conversation.close_logs()
+            
+            if self._tool_executor is not None:
+                self._tool_executor.shutdown(wait=True)
+                self._tool_executor = None
+            
+            self._drop_cached_prefix()
             
             # Close any open file handles in logger
             if hasattr(self.logger_manager, 'cleanup'):
                 self.logger_manager.cleanup()
             
             # Log final metrics
-            self.logger.info(f"Agent cleanup completed. Final metrics: {self.metrics}")
+            self.logger.info(f"Agent cleanup completed. Final metrics: {self.get_metrics()}")
             
         except Exception as e:
             # Use print as fallback if logger is already closed
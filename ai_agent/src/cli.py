@@ -5,8 +5,9 @@ Interactive CLI Interface
 Provides an interactive command-line interface for the AI Agent.
 """
 
+import re
 import sys
-import os
+import time
 import readline
 import atexit
 from pathlib import Path
@@ -17,11 +18,40 @@ from rich.table import Table
 from rich.panel import Panel
 from rich.syntax import Syntax
 from rich.progress import Progress, SpinnerColumn, TextColumn
+from rich.live import Live
+from rich.spinner import Spinner
 from rich.prompt import Prompt, Confirm
 from rich import print as rprint
 
 from .agent import Agent
 from .config import Config
+from .tools.system_tools import get_system_info
+
+# A fenced code block with an optional language tag (which may follow a
+# space); an unterminated fence runs to the end of the response
+_CODE_BLOCK_RE = re.compile(r"```[^\S\n]*([\w+#.-]*)[^\S\n]*\n?(.*?)(?:```|\Z)", re.DOTALL)
+
+# get_system_info walks every process and several /proc counters; repeated
+# /system commands within this window reuse the last reading
+_SYSINFO_TTL = 5.0
+
+# Minimum seconds between rebuilds of the streaming preview; each rebuild
+# re-parses the whole answer so far as markdown
+_STREAM_RENDER_INTERVAL = 0.25
+_sysinfo_cache: Optional[Tuple[float, dict]] = None
+
+
+def _cached_system_info() -> dict:
+    """Return get_system_info(), reusing a result younger than _SYSINFO_TTL."""
+    global _sysinfo_cache
+    now = time.monotonic()
+    if _sysinfo_cache and now - _sysinfo_cache[0] < _SYSINFO_TTL:
+        return _sysinfo_cache[1]
+    
+    info = get_system_info()
+    if "error" not in info:
+        _sysinfo_cache = (now, info)
+    return info
 
 
 class InteractiveCLI:
@@ -77,15 +107,28 @@ class InteractiveCLI:
         """Setup command history."""
         self.history_file.parent.mkdir(parents=True, exist_ok=True)
         
+        # Set history length
+        readline.set_history_length(1000)
+        
         # Load history if exists
         if self.history_file.exists():
             readline.read_history_file(self.history_file)
         
-        # Set history length
-        readline.set_history_length(1000)
-        
-        # Save history on exit
-        atexit.register(lambda: readline.write_history_file(self.history_file))
+        if hasattr(readline, "append_history_file"):
+            # Lines are appended as they are entered (see _append_history);
+            # trim an overgrown file once here instead of rewriting it on exit
+            if readline.get_current_history_length() > 1000:
+                readline.write_history_file(self.history_file)
+            self.history_file.touch(exist_ok=True)
+        else:
+            # Save history on exit
+            atexit.register(lambda: readline.write_history_file(self.history_file))
+    
+    def _append_history(self, line: str):
+        """Append a line readline just recorded to the history file."""
+        # input() adds every non-empty line to the in-memory history
+        if line and hasattr(readline, "append_history_file"):
+            readline.append_history_file(1, self.history_file)
     
     def _setup_autocomplete(self):
         """Setup auto-completion for commands."""
@@ -158,7 +201,9 @@ Type your question or command to get started!
         try:
             # Show prompt
             prompt = f"\n[bold cyan]{self.agent.config.prompt_style}[/bold cyan]"
-            return Prompt.ask(prompt, console=self.console).strip()
+            user_input = Prompt.ask(prompt, console=self.console)
+            self._append_history(user_input)
+            return user_input.strip()
         except KeyboardInterrupt:
             return ""
     
@@ -175,24 +220,38 @@ Type your question or command to get started!
             self.console.print("[yellow]Type /help for available commands[/yellow]")
     
     def _process_query(self, query: str):
-        """Process a query with the agent."""
-        with Progress(
-            SpinnerColumn(),
-            TextColumn("[progress.description]{task.description}"),
+        """Process a query with the agent, previewing the answer as it streams in."""
+        chunks = []
+        error = None
+        # The preview is transient; the finished answer is rendered once below
+        with Live(
+            Spinner("dots", text="Thinking..."),
             console=self.console,
+            refresh_per_second=20,
             transient=True
-        ) as progress:
-            task = progress.add_task("Thinking...", total=None)
-            
+        ) as live:
             try:
-                # Get response from agent
-                response = self.agent.process_request(query)
-                
-                # Display response with formatting
-                self._display_response(response)
+                last_render = 0.0
+                for chunk in self.agent.process_request_stream(query):
+                    chunks.append(chunk)
+                    now = time.monotonic()
+                    if now - last_render >= _STREAM_RENDER_INTERVAL:
+                        last_render = now
+                        live.update(Panel(
+                            Markdown("".join(chunks)),
+                            title="Assistant",
+                            border_style="green",
+                            padding=(1, 2)
+                        ))
             
             except Exception as e:
-                self.console.print(f"[red]Error processing query: {e}[/red]")
+                error = e
+        
+        response = "".join(chunks)
+        if response:
+            self._display_response(response)
+        if error is not None:
+            self.console.print(f"[red]Error processing query: {error}[/red]")
     
     def _display_response(self, response: str):
         """Display agent response with rich formatting."""
@@ -210,25 +269,25 @@ Type your question or command to get started!
     
     def _display_with_code_blocks(self, response: str):
         """Display response with syntax-highlighted code blocks."""
-        parts = response.split("```")
+        last_end = 0
+        for match in _CODE_BLOCK_RE.finditer(response):
+            # Regular text
+            text = response[last_end:match.start()]
+            if text.strip():
+                self.console.print(Markdown(text))
+            last_end = match.end()
+            
+            # Code block
+            self.console.print(Syntax(
+                match.group(2).strip(),
+                match.group(1) or "text",
+                theme="monokai",
+                line_numbers=True
+            ))
         
-        for i, part in enumerate(parts):
-            if i % 2 == 0:
-                # Regular text
-                if part.strip():
-                    self.console.print(Markdown(part))
-            else:
-                # Code block
-                lines = part.split("\n", 1)
-                language = lines[0].strip() if lines[0].strip() else "text"
-                code = lines[1] if len(lines) > 1 else part
-                
-                self.console.print(Syntax(
-                    code.strip(),
-                    language,
-                    theme="monokai",
-                    line_numbers=True
-                ))
+        text = response[last_end:]
+        if text.strip():
+            self.console.print(Markdown(text))
     
     def _show_help(self, args: str = ""):
         """Show help message."""
@@ -277,7 +336,7 @@ Type your question or command to get started!
     
     def _clear_screen(self, args: str = ""):
         """Clear the screen."""
-        os.system('clear' if os.name == 'posix' else 'cls')
+        self.console.clear()
     
     def _reset_session(self, args: str = ""):
         """Reset the conversation session."""
@@ -459,8 +518,6 @@ Type your question or command to get started!
     
     def _show_system_info(self, args: str = ""):
         """Show system information."""
-        from .tools.system_tools import get_system_info
-        
         with Progress(
             SpinnerColumn(),
             TextColumn("[progress.description]{task.description}"),
@@ -468,7 +525,7 @@ Type your question or command to get started!
             transient=True
         ) as progress:
             task = progress.add_task("Getting system info...", total=None)
-            info = get_system_info()
+            info = _cached_system_info()
         
         if "error" in info:
             self.console.print(f"[red]Error: {info['error']}[/red]")
@@ -7,13 +7,35 @@ environment variable support, and runtime configuration updates.
 """
 
 import os
-import json
+import copy
+import functools
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Sequence
 from dataclasses import dataclass, field
 from enum import Enum
 from dotenv import load_dotenv
 
+from . import _json
+
+@functools.lru_cache(maxsize=16)
+def _parse_config_file(path: str, mtime_ns: int, size: int) -> Dict[str, Any]:
+    """Parse a JSON config file; the stat fields key the cache so edits are picked up."""
+    with open(path, 'rb') as f:
+        return _json.loads(f.read())
+
+
+@functools.lru_cache(maxsize=None)
+def _load_env():
+    """Load ``.env`` into the environment; done once, on first use."""
+    load_dotenv()
+
+
+def _getenv(name: str, default: Optional[str] = None) -> Optional[str]:
+    """Read an environment variable after ``.env`` has been loaded."""
+    _load_env()
+    return os.environ.get(name, default)
+
+
 class ModelType(Enum):
     """Supported AI model types"""
     GEMINI_FLASH = "gemini-2.0-flash-001"
@@ -30,6 +52,24 @@ class LogLevel(Enum):
     CRITICAL = "CRITICAL"
 
 
+# Immutable, so every Config can share it
+_ALLOWED_EXTENSIONS = frozenset({
+    ".py", ".js", ".ts", ".jsx", ".tsx", ".java", ".cpp", ".c", ".h",
+    ".go", ".rs", ".rb", ".php", ".swift", ".kt", ".scala", ".r",
+    ".md", ".txt", ".json", ".yaml", ".yml", ".toml", ".xml", ".html",
+    ".css", ".scss", ".sass", ".sql", ".sh", ".bash", ".zsh", ".fish"
+})
+
+
+@functools.lru_cache(maxsize=8)
+def _render_system_prompt(template: str, working_dir: str, available_tools: tuple) -> str:
+    """Format the system prompt; called on every model request, so memoized."""
+    return template.format(
+        working_dir=working_dir,
+        available_tools=", ".join(available_tools)
+    )
+
+
 @dataclass
 class Config:
     """
@@ -44,24 +84,42 @@ class Config:
         working_dir: Default working directory for file operations
         log_level: Logging verbosity level
         enable_cache: Whether to enable response caching
+        cache_size: Maximum number of cached responses kept in memory
+        cache_history_threshold: Skip the response cache past this many context messages
+        semantic_cache_size: Maximum number of prompt embeddings kept for paraphrase matching
+            (0, the default, disables it; only used at temperature 0)
+        semantic_cache_threshold: Cosine similarity at which a cached answer is reused
+        embedding_model: Model used to embed prompts for the semantic cache
+        context_cache_ttl: Seconds the system prompt and tool declarations are kept
+            in a server-side context cache (0 sends them inline with every request)
         cache_dir: Directory for storing cache files
         history_file: Path to conversation history file
+        save_every_turns: Persist the session to disk every N turns (always on exit)
+        save_interval: Also persist once this many seconds have passed since the last save
+        history_window: Messages kept in memory per session; older ones are archived to disk
+        max_input_chars: Longest user input sent to the model
+        max_context_tokens: Prompt size at which the oldest messages of a turn are dropped
+            (0 for no limit)
+        blocked_patterns: Regexes for input that is refused without a model call
         max_file_size: Maximum file size to read (in bytes)
         timeout: Request timeout in seconds
         retry_attempts: Number of retry attempts for failed requests
+        retry_delay: Base delay in seconds for exponential retry backoff
+        retry_max_delay: Upper bound in seconds on a single retry wait
         interactive_mode: Whether to run in interactive mode
+        daemon_idle_timeout: Seconds the ``--daemon`` agent waits for a request
+            before exiting (0 keeps it running until stopped)
     """
     
     # Core settings
-    load_dotenv()
-    api_key: str = field(default_factory=lambda: os.getenv("GEMINI_API_KEY", ""))
+    api_key: str = field(default_factory=lambda: _getenv("GEMINI_API_KEY", ""))
     model: ModelType = ModelType.GEMINI_FLASH
     max_iterations: int = 30
     max_tokens: int = 8192
     temperature: float = 0.7
     
     # Directory settings
-    working_dir: Path = field(default_factory=lambda: os.getenv("WORKING_DIRECTORY") or Path.cwd())
+    working_dir: Path = field(default_factory=lambda: _getenv("WORKING_DIRECTORY") or Path.cwd())
     cache_dir: Path = field(default_factory=lambda: Path.home() / ".ai_agent" / "cache")
     data_dir: Path = field(default_factory=lambda: Path.home() / ".ai_agent" / "data")
     
@@ -74,26 +132,41 @@ class Config:
     enable_history: bool = True
     enable_auto_fix: bool = True
     enable_code_analysis: bool = True
+    save_every_turns: int = 5
+    save_interval: float = 30.0
+    history_window: int = 200
+    
+    # Input screening
+    max_input_chars: int = 200_000
+    max_context_tokens: int = 500_000
+    blocked_patterns: list = field(default_factory=list)
+    
+    # Response cache
+    cache_size: int = 1024
+    cache_history_threshold: int = 10
+    semantic_cache_size: int = 0
+    semantic_cache_threshold: float = 0.92
+    embedding_model: str = "text-embedding-004"
+    context_cache_ttl: int = 0
     
     # File handling
     max_file_size: int = 1024 * 1024 * 10  # 10MB
     max_file_count: int = 100
-    allowed_extensions: set = field(default_factory=lambda: {
-        ".py", ".js", ".ts", ".jsx", ".tsx", ".java", ".cpp", ".c", ".h",
-        ".go", ".rs", ".rb", ".php", ".swift", ".kt", ".scala", ".r",
-        ".md", ".txt", ".json", ".yaml", ".yml", ".toml", ".xml", ".html",
-        ".css", ".scss", ".sass", ".sql", ".sh", ".bash", ".zsh", ".fish"
-    })
+    allowed_extensions: frozenset = _ALLOWED_EXTENSIONS
     
     # Network settings
     timeout: int = 60
     retry_attempts: int = 3
     retry_delay: float = 1.0
+    retry_max_delay: float = 30.0
     
     # Interactive mode settings
     interactive_mode: bool = False
     prompt_style: str = "▶ "
     
+    # Warm daemon settings
+    daemon_idle_timeout: int = 900
+    
     # System prompt customization
     system_prompt_template: str = """You are an advanced AI coding assistant with the following capabilities:
 
@@ -148,9 +221,9 @@ Available tools: {available_tools}
         config_file = self.data_dir / "config.json"
         if config_file.exists():
             try:
-                with open(config_file, 'r') as f:
-                    user_config = json.load(f)
-                    self._update_from_dict(user_config)
+                with open(config_file, 'rb') as f:
+                    user_config = _json.loads(f.read())
+                self._update_from_dict(user_config)
             except Exception as e:
                 print(f"Warning: Could not load user config: {e}")
     
@@ -182,22 +255,24 @@ Available tools: {available_tools}
             "interactive_mode": self.interactive_mode,
         }
         
-        with open(config_file, 'w') as f:
-            json.dump(config_dict, f, indent=2)
+        with open(config_file, 'wb') as f:
+            f.write(_json.dumps_pretty(config_dict))
     
     @classmethod
     def from_file(cls, config_path: Path) -> "Config":
         """Load configuration from a specific file"""
-        with open(config_path, 'r') as f:
-            config_dict = json.load(f)
+        path = os.fspath(config_path)
+        st = os.stat(path)
+        config_dict = copy.deepcopy(_parse_config_file(path, st.st_mtime_ns, st.st_size))
         
         config = cls()
         config._update_from_dict(config_dict)
         return config
     
-    def get_system_prompt(self, available_tools: list) -> str:
+    def get_system_prompt(self, available_tools: Sequence[str]) -> str:
         """Generate system prompt with current configuration"""
-        return self.system_prompt_template.format(
-            working_dir=self.working_dir,
-            available_tools=", ".join(available_tools)
+        return _render_system_prompt(
+            self.system_prompt_template,
+            str(self.working_dir),
+            tuple(available_tools)
         )
@@ -5,16 +5,36 @@ Conversation Management System
 Handles conversation history, context management, and session persistence.
 """
 
-import json
+import io
+import os
+import re
+import heapq
+import operator
 import uuid
+import itertools
+import threading
+from collections import Counter, defaultdict, deque
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Any, Optional, Iterator, Iterable, Set, TextIO
+from dataclasses import dataclass, field
 from google.genai import types
 
+from . import _json
 
-@dataclass
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _entry_mtime(entry: os.DirEntry) -> float:
+    """Modification time of a directory entry, 0 if it vanished."""
+    try:
+        return entry.stat().st_mtime
+    except OSError:
+        return 0
+
+
+@dataclass(slots=True)
 class Message:
     """
     Represents a single message in the conversation.
@@ -30,6 +50,18 @@ class Message:
     timestamp: datetime = field(default_factory=datetime.now)
     metadata: Dict[str, Any] = field(default_factory=dict)
     message_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    # Gemini form of the message, built once by gemini_content(); messages
+    # are never edited, so it needs no invalidation. Not serialized.
+    _gemini_content: Optional[types.Content] = field(default=None, repr=False, compare=False)
+    
+    def gemini_content(self) -> types.Content:
+        """Return the message as a Gemini content, reusing it across turns."""
+        if self._gemini_content is None:
+            self._gemini_content = types.Content(
+                role=self.role,
+                parts=[types.Part(text=self.content)]
+            )
+        return self._gemini_content
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert message to dictionary for serialization"""
@@ -48,7 +80,7 @@ class Message:
         return cls(**data)
 
 
-@dataclass
+@dataclass(slots=True)
 class ConversationSession:
     """
     Represents a complete conversation session.
@@ -59,12 +91,22 @@ class ConversationSession:
         created_at: When the session was created
         updated_at: When the session was last updated
         metadata: Session metadata (tags, context, etc.)
+        archived_count: Number of older messages dropped from ``messages``;
+            they are read back from the session's JSONL log
+        persisted_count: Number of messages already written to the JSONL log
     """
     session_id: str = field(default_factory=lambda: str(uuid.uuid4()))
     messages: List[Message] = field(default_factory=list)
     created_at: datetime = field(default_factory=datetime.now)
     updated_at: datetime = field(default_factory=datetime.now)
     metadata: Dict[str, Any] = field(default_factory=dict)
+    archived_count: int = 0
+    persisted_count: int = field(default=0, repr=False, compare=False)
+    
+    @property
+    def message_count(self) -> int:
+        """Total messages in the session, including archived ones."""
+        return self.archived_count + len(self.messages)
     
     def add_message(self, message: Message):
         """Add a message to the session"""
@@ -78,7 +120,8 @@ class ConversationSession:
             "messages": [msg.to_dict() for msg in self.messages],
             "created_at": self.created_at.isoformat(),
             "updated_at": self.updated_at.isoformat(),
-            "metadata": self.metadata
+            "metadata": self.metadata,
+            "archived_count": self.archived_count
         }
     
     @classmethod
@@ -100,7 +143,7 @@ class ConversationSession:
         
         summary_parts = [
             f"Session ID: {self.session_id[:8]}...",
-            f"Messages: {len(self.messages)}",
+            f"Messages: {self.message_count}",
             f"Duration: {(self.updated_at - self.created_at).total_seconds():.1f}s",
         ]
         
@@ -124,37 +167,84 @@ class ConversationManager:
     - Context window management
     - Search and retrieval of past conversations
     - Analytics and insights
+    
+    Saving a session appends the messages added since the last save to
+    ``<session_id>.jsonl``, so earlier messages are never rewritten;
+    ``<session_id>.json`` only holds the session's metadata. With a
+    ``window_size`` only the most recent messages of a session are kept in
+    memory; older ones are appended to the log as they are evicted and read
+    back from it for export and search.
     """
     
-    def __init__(self, history_dir: Optional[Path] = None):
+    def __init__(
+        self,
+        history_dir: Optional[Path] = None,
+        window_size: Optional[int] = None,
+        persist: bool = True
+    ):
         """
         Initialize the conversation manager.
         
         Args:
             history_dir: Directory to store conversation history
+            window_size: Messages kept in memory per session (None for unbounded)
+            persist: Write a session's metadata file as soon as it is created,
+                so it is found on reload even if no save follows; messages
+                are always written by save_session
         """
         self.history_dir = history_dir or (Path.home() / ".ai_agent" / "history")
         self.history_dir.mkdir(parents=True, exist_ok=True)
+        self.window_size = window_size
+        self.persist = persist
         
         self.current_session: Optional[ConversationSession] = None
         self.sessions: Dict[str, ConversationSession] = {}
+        # Guards message lists against background saves (see Agent._schedule_save)
+        self._lock = threading.Lock()
         
-        self._load_recent_sessions()
+        # Search index: lower-cased word -> ids of sessions containing it,
+        # plus the reverse mapping for removal. Built by search_sessions, not
+        # as messages arrive; _indexed_counts records how many of each
+        # session's messages it covers (see _update_index)
+        self._index: Dict[str, Set[str]] = defaultdict(set)
+        self._session_words: Dict[str, Set[str]] = defaultdict(set)
+        self._indexed_counts: Dict[str, int] = {}
+        # Open append handles of session logs, see _append_unpersisted
+        self._log_files: Dict[str, TextIO] = {}
+        # Messages per role for each session, kept current by add_message;
+        # sessions read from disk are counted on first use (get_statistics)
+        self._role_counts: Dict[str, Counter] = {}
+        
+        # Recent sessions are read from disk on first search or statistics
+        # call (see _ensure_loaded), not at startup
+        self._recent_loaded = False
+    
+    def _ensure_loaded(self):
+        """Load the recent sessions from disk once."""
+        if self._recent_loaded:
+            return
+        self._recent_loaded = True
+        # Loaded sessions go first, as they did when read at startup;
+        # sessions already in memory keep their object
+        in_memory, self.sessions = self.sessions, {}
+        self._load_recent_sessions(skip=in_memory.keys())
+        self.sessions.update(in_memory)
     
-    def _load_recent_sessions(self, limit: int = 10):
+    def _load_recent_sessions(self, limit: int = 10, skip: Iterable[str] = ()):
         """Load recent sessions from disk"""
-        session_files = sorted(
-            self.history_dir.glob("*.json"),
-            key=lambda p: p.stat().st_mtime,
-            reverse=True
-        )[:limit]
+        # scandir entries cache their stat, and only the newest `limit` are kept
+        with os.scandir(self.history_dir) as it:
+            entries = [entry for entry in it if entry.name.endswith(".json")]
+        recent = heapq.nlargest(limit, entries, key=_entry_mtime)
         
-        for session_file in session_files:
+        skip = set(skip)
+        for entry in recent:
+            session_file = Path(entry.path)
+            if session_file.stem in skip:
+                continue
             try:
-                with open(session_file, 'r') as f:
-                    session_data = json.load(f)
-                    session = ConversationSession.from_dict(session_data)
-                    self.sessions[session.session_id] = session
+                session = self._read_session(session_file)
+                self.sessions[session.session_id] = session
             except Exception as e:
                 print(f"Warning: Could not load session {session_file}: {e}")
     
@@ -162,7 +252,10 @@ class ConversationManager:
         """Create a new conversation session"""
         session = ConversationSession(metadata=metadata or {})
         self.sessions[session.session_id] = session
+        self._role_counts[session.session_id] = Counter()
         self.current_session = session
+        if self.persist:
+            self._write_metadata(session)
         return session
     
     def get_session(self, session_id: str) -> Optional[ConversationSession]:
@@ -174,21 +267,77 @@ class ConversationManager:
         session_file = self.history_dir / f"{session_id}.json"
         if session_file.exists():
             try:
-                with open(session_file, 'r') as f:
-                    session_data = json.load(f)
-                    session = ConversationSession.from_dict(session_data)
-                    self.sessions[session_id] = session
-                    return session
+                session = self._read_session(session_file)
+                self.sessions[session_id] = session
+                return session
             except Exception:
                 pass
         
         return None
     
+    def _read_session(self, session_file: Path) -> ConversationSession:
+        """Load a session from its metadata file and the tail of its log."""
+        data = _json.loads(session_file.read_bytes())
+        if "messages" in data:
+            # Written before the append-only log: the file holds the
+            # in-memory messages, which go to the log on the next save
+            session = ConversationSession.from_dict(data)
+            session.persisted_count = session.archived_count
+            return session
+        
+        # The log is the source of truth for messages; the metadata may
+        # predate the last few appends
+        total = 0
+        tail = deque(maxlen=self.window_size)
+        log_file = session_file.with_suffix(".jsonl")
+        if log_file.exists():
+            with open(log_file, 'rb') as f:
+                for line in f:
+                    if line.endswith(b"\n"):  # skip a torn final write
+                        tail.append(line)
+                        total += 1
+        data["messages"] = [_json.loads(line) for line in tail]
+        data["archived_count"] = total - len(tail)
+        session = ConversationSession.from_dict(data)
+        session.persisted_count = total
+        return session
+    
     def save_session(self, session: ConversationSession):
         """Save a session to disk"""
+        with self._lock:
+            self._append_unpersisted(session)
+            session_data = self._metadata_bytes(session)
+        self._write_metadata(session, session_data)
+    
+    @staticmethod
+    def _metadata_bytes(session: ConversationSession) -> bytes:
+        """Serialize a session's metadata file."""
+        return _json.dumps_pretty({
+            "session_id": session.session_id,
+            "created_at": session.created_at,
+            "updated_at": session.updated_at,
+            "metadata": session.metadata
+        })
+    
+    def _write_metadata(self, session: ConversationSession, session_data: Optional[bytes] = None):
+        """Write a session's ``<session_id>.json`` metadata file."""
+        if session_data is None:
+            session_data = self._metadata_bytes(session)
         session_file = self.history_dir / f"{session.session_id}.json"
-        with open(session_file, 'w') as f:
-            json.dump(session.to_dict(), f, indent=2)
+        session_file.write_bytes(session_data)
+    
+    def _append_unpersisted(self, session: ConversationSession):
+        """Append the session's messages not yet in its log. Caller holds ``_lock``."""
+        pending = session.messages[session.persisted_count - session.archived_count:]
+        if not pending:
+            return
+        log = self._log_files.get(session.session_id)
+        if log is None:
+            log = open(self.history_dir / f"{session.session_id}.jsonl", 'a', encoding='utf-8')
+            self._log_files[session.session_id] = log
+        log.write("".join(_json.dumps(msg) + "\n" for msg in pending))
+        log.flush()
+        session.persisted_count += len(pending)
     
     def add_message(self, role: str, content: str, metadata: Optional[Dict[str, Any]] = None):
         """Add a message to the current session"""
@@ -196,38 +345,150 @@ class ConversationManager:
             self.create_session()
         
         message = Message(role=role, content=content, metadata=metadata or {})
-        self.current_session.add_message(message)
+        with self._lock:
+            self.current_session.add_message(message)
+            role_counts = self._role_counts.get(self.current_session.session_id)
+            if role_counts is not None:
+                role_counts[role] += 1
+            # Trim in batches so the list shift is amortized
+            if self.window_size and len(self.current_session.messages) >= 2 * self.window_size:
+                self._archive_messages(self.current_session)
         return message
     
-    def get_context(self, max_messages: int = 10) -> List[types.Content]:
-        """Get conversation context in Gemini format"""
-        if not self.current_session:
-            return []
+    def _archive_messages(self, session: ConversationSession):
+        """Drop all but the newest ``window_size`` messages from memory."""
+        # Evicted messages must reach the log first; this runs once per
+        # window_size messages, so the write is amortized
+        self._append_unpersisted(session)
+        evicted = len(session.messages) - self.window_size
+        del session.messages[:evicted]
+        session.archived_count += evicted
+    
+    def _index_messages(self, session_id: str, messages: Iterable[Message]):
+        """Add the words of ``messages`` to the search index."""
+        words = self._session_words[session_id]
+        for message in messages:
+            for word in _WORD_RE.findall(message.content.lower()):
+                if word not in words:
+                    words.add(word)
+                    self._index[word].add(session_id)
+    
+    def _update_index(self):
+        """Index the messages added to any session since the last search."""
+        for session in list(self.sessions.values()):
+            done = self._indexed_counts.get(session.session_id, 0)
+            with self._lock:
+                total = session.message_count
+                if done >= total:
+                    continue
+                archived = session.archived_count
+                recent = session.messages[max(done - archived, 0):]
+            if done < archived:
+                # Messages archived since the last search are read back from the log
+                log_file = self.history_dir / f"{session.session_id}.jsonl"
+                with open(log_file, 'rb') as f:
+                    archive = [
+                        Message.from_dict(_json.loads(line))
+                        for line in itertools.islice(f, done, archived)
+                    ]
+                self._index_messages(session.session_id, archive)
+            self._index_messages(session.session_id, recent)
+            self._indexed_counts[session.session_id] = total
+    
+    def _unindex_session(self, session_id: str):
+        """Remove a session from the search index."""
+        self._indexed_counts.pop(session_id, None)
+        for word in self._session_words.pop(session_id, ()):
+            ids = self._index.get(word)
+            if ids is not None:
+                ids.discard(session_id)
+                if not ids:
+                    del self._index[word]
+    
+    def _search_candidates(self, query: str) -> Optional[Set[str]]:
+        """
+        Ids of sessions that may contain ``query``; callers verify the match.
         
-        context_messages = self.current_session.get_context_window(max_messages)
-        gemini_messages = []
+        A query word found in the index is looked up directly. Only a word
+        the index does not hold (a fragment such as "pyth") falls back to
+        scanning the vocabulary for words that contain it. Returns None when
+        the query has no word characters and every session has to be checked.
+        """
+        query_words = _WORD_RE.findall(query)
+        if not query_words:
+            return None
         
-        for msg in context_messages:
-            # Convert to Gemini format
-            if msg.role in ["user", "model"]:
-                gemini_messages.append(
-                    types.Content(
-                        role=msg.role,
-                        parts=[types.Part(text=msg.content)]
-                    )
-                )
+        self._update_index()
         
-        return gemini_messages
+        candidates: Optional[Set[str]] = None
+        # Exact words first: they are cheap and usually narrow the most
+        for query_word in sorted(set(query_words), key=lambda w: w not in self._index):
+            ids = self._index.get(query_word)
+            if ids is None:
+                ids = set()
+                for word, word_ids in self._index.items():
+                    if query_word in word:
+                        ids |= word_ids
+            candidates = set(ids) if candidates is None else candidates & ids
+            if not candidates:
+                break
+        return candidates
+    
+    def iter_messages(self, session: ConversationSession) -> Iterator[Message]:
+        """Iterate over every message of a session, archived ones first."""
+        if session.archived_count:
+            log_file = self.history_dir / f"{session.session_id}.jsonl"
+            with open(log_file, 'rb') as f:
+                for line in itertools.islice(f, session.archived_count):
+                    yield Message.from_dict(_json.loads(line))
+        yield from list(session.messages)
+    
+    def get_context(self, max_messages: int = 10, start: Optional[int] = None) -> List[types.Content]:
+        """
+        Get conversation context in Gemini format.
+        
+        Args:
+            max_messages: Number of most recent messages to return
+            start: Session-wide index of the first message to return instead;
+                messages already archived to disk are skipped
+        """
+        if not self.current_session:
+            return []
+        
+        if start is None:
+            context_messages = self.current_session.get_context_window(max_messages)
+        else:
+            session = self.current_session
+            context_messages = session.messages[max(start - session.archived_count, 0):]
+        return [
+            msg.gemini_content() for msg in context_messages
+            if msg.role in ("user", "model")
+        ]
     
     def search_sessions(self, query: str, limit: int = 10) -> List[ConversationSession]:
         """Search for sessions containing specific content"""
+        self._ensure_loaded()
         matching_sessions = []
+        query = query.lower()
+        candidates = self._search_candidates(query)
+        sessions = self.sessions.values() if candidates is None else [
+            self.sessions[session_id] for session_id in candidates
+            if session_id in self.sessions
+        ]
         
-        for session in self.sessions.values():
+        # Most recently active first, so `limit` keeps the newest matches
+        for session in sorted(sessions, key=operator.attrgetter("updated_at"), reverse=True):
+            # The in-memory window is checked first; the archive only on a miss
             for message in session.messages:
-                if query.lower() in message.content.lower():
+                if query in message.content.lower():
                     matching_sessions.append(session)
                     break
+            else:
+                if session.archived_count and any(
+                    query in message.content.lower()
+                    for message in self.iter_messages(session)
+                ):
+                    matching_sessions.append(session)
             
             if len(matching_sessions) >= limit:
                 break
@@ -236,19 +497,23 @@ class ConversationManager:
     
     def get_statistics(self) -> Dict[str, Any]:
         """Get conversation statistics"""
-        total_messages = sum(len(s.messages) for s in self.sessions.values())
+        self._ensure_loaded()
+        total_messages = sum(s.message_count for s in self.sessions.values())
         total_sessions = len(self.sessions)
         
-        role_counts = {}
+        role_counts = Counter()
         for session in self.sessions.values():
-            for message in session.messages:
-                role_counts[message.role] = role_counts.get(message.role, 0) + 1
+            session_counts = self._role_counts.get(session.session_id)
+            if session_counts is None:
+                session_counts = Counter(message.role for message in self.iter_messages(session))
+                self._role_counts[session.session_id] = session_counts
+            role_counts.update(session_counts)
         
         return {
             "total_sessions": total_sessions,
             "total_messages": total_messages,
             "average_messages_per_session": total_messages / total_sessions if total_sessions > 0 else 0,
-            "role_distribution": role_counts,
+            "role_distribution": dict(role_counts),
             "oldest_session": min(
                 (s.created_at for s in self.sessions.values()),
                 default=None
@@ -266,23 +531,25 @@ class ConversationManager:
             raise ValueError(f"Session {session_id} not found")
         
         if format == "json":
-            return json.dumps(session.to_dict(), indent=2)
+            session_data = session.to_dict()
+            if session.archived_count:
+                session_data["messages"] = [msg.to_dict() for msg in self.iter_messages(session)]
+                session_data["archived_count"] = 0
+            return _json.dumps_pretty(session_data).decode("utf-8")
         elif format == "markdown":
-            lines = [
-                f"# Conversation Session: {session.session_id}",
-                f"**Created:** {session.created_at}",
-                f"**Updated:** {session.updated_at}",
-                "",
-                "## Messages",
-                ""
-            ]
-            
-            for msg in session.messages:
-                lines.append(f"### {msg.role.title()} ({msg.timestamp})")
-                lines.append(msg.content)
-                lines.append("")
+            # Written straight into one buffer; no per-line list to join
+            buf = io.StringIO()
+            buf.write(
+                f"# Conversation Session: {session.session_id}\n"
+                f"**Created:** {session.created_at}\n"
+                f"**Updated:** {session.updated_at}\n"
+                "\n"
+                "## Messages\n"
+            )
+            for msg in self.iter_messages(session):
+                buf.write(f"\n### {msg.role.title()} ({msg.timestamp})\n{msg.content}\n")
             
-            return "\n".join(lines)
+            return buf.getvalue()
         else:
             raise ValueError(f"Unsupported export format: {format}")
     
@@ -290,15 +557,33 @@ class ConversationManager:
         """Clear sessions older than specified days"""
         cutoff_date = datetime.now().timestamp() - (days * 24 * 60 * 60)
         
-        for session_file in self.history_dir.glob("*.json"):
-            if session_file.stat().st_mtime < cutoff_date:
-                session_file.unlink()
-                
-                # Remove from memory if loaded
-                session_id = session_file.stem
-                self.sessions.pop(session_id, None)
+        with os.scandir(self.history_dir) as it:
+            stale = [
+                entry.name[:-len(".json")] for entry in it
+                if entry.name.endswith(".json") and _entry_mtime(entry) < cutoff_date
+            ]
+        
+        for session_id in stale:
+            log = self._log_files.pop(session_id, None)
+            if log is not None:
+                log.close()
+            (self.history_dir / f"{session_id}.json").unlink(missing_ok=True)
+            (self.history_dir / f"{session_id}.jsonl").unlink(missing_ok=True)
+            
+            # Remove from memory if loaded
+            self.sessions.pop(session_id, None)
+            self._role_counts.pop(session_id, None)
+            self._unindex_session(session_id)
+    
     def close(self):
         """Perform any cleanup actions"""
         if self.current_session:
             self.save_session(self.current_session)
-        # Additional cleanup if needed
+        self.close_logs()
+    
+    def close_logs(self):
+        """Close the append handles of session logs; they reopen on demand."""
+        with self._lock:
+            for log in self._log_files.values():
+                log.close()
+            self._log_files.clear()
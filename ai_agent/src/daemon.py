@@ -0,0 +1,310 @@
+"""
+Warm Agent Daemon
+=================
+
+Keeps a fully initialized Agent in a long-lived process so one-shot CLI
+queries skip importing the Gemini SDK and building the agent. Requests
+arrive over a Unix domain socket; each one is served in a forked child
+so it gets a clean copy-on-write copy of the warm agent, running in the
+client's working directory. The daemon exits after
+``config.daemon_idle_timeout`` seconds without a request, or on ``stop()``.
+
+Run with ``python -m src.daemon`` from the ``ai_agent`` directory.
+"""
+
+import os
+import sys
+import json
+import stat
+import time
+import socket
+import signal
+import select
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+
+def socket_path(create: bool = False) -> Optional[str]:
+    """
+    Return the Unix socket path used by the daemon.
+
+    The socket lives in a directory only the current user can access:
+    ``$XDG_RUNTIME_DIR`` or, failing that, a 0700 directory under the
+    system temp dir, so other local users can neither plant nor reach it.
+
+    Args:
+        create: Create the fallback directory if it does not exist yet
+
+    Returns:
+        The socket path, or None if the directory is not private to this user
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if not runtime_dir:
+        runtime_dir = os.path.join(tempfile.gettempdir(), f"ai_agent-{os.getuid()}")
+        if create:
+            try:
+                os.mkdir(runtime_dir, 0o700)
+            except FileExistsError:
+                pass
+    try:
+        st = os.lstat(runtime_dir)
+    except FileNotFoundError:
+        return None
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        return None
+    return os.path.join(runtime_dir, "ai_agent.sock")
+
+
+def _owned_socket(path: Optional[str]) -> bool:
+    """Whether ``path`` is a socket owned by the current user."""
+    if not path:
+        return False
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+
+def is_supported() -> bool:
+    """Whether this platform can run the daemon (needs fork + AF_UNIX)."""
+    return hasattr(socket, "AF_UNIX") and hasattr(os, "fork")
+
+
+def _accepts(path: str) -> bool:
+    """Whether something is accepting connections on the socket at ``path``."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+            return True
+    except (FileNotFoundError, ConnectionRefusedError):
+        return False
+
+
+def is_running() -> bool:
+    """Whether a daemon of the current user is accepting connections."""
+    path = socket_path()
+    return _owned_socket(path) and _accepts(path)
+
+
+def request(payload: Dict[str, Any], timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """
+    Send a request to a running daemon.
+
+    Args:
+        payload: Request with ``query``, the client's ``cwd`` and optional
+            ``context``/config overrides, or a ``command`` such as "stop"
+        timeout: Socket timeout in seconds (None blocks until the reply)
+
+    Returns:
+        The decoded reply, or None if no daemon is listening or the
+        request's worker died without replying
+    """
+    path = socket_path()
+    # Never send a query (or file contents) to a socket someone else made
+    if not _owned_socket(path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            sock.sendall(json.dumps(payload).encode("utf-8") + b"\n")
+            sock.shutdown(socket.SHUT_WR)
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+    if not chunks:
+        return None
+    return json.loads(b"".join(chunks))
+
+
+def stop() -> bool:
+    """
+    Ask the running daemon to exit.
+
+    Returns:
+        True if a daemon acknowledged the request, False if none was running
+    """
+    return request({"command": "stop"}, timeout=10) is not None
+
+
+def spawn(wait: float = 30.0) -> bool:
+    """
+    Start a daemon in the background and wait for its socket to appear.
+
+    Returns:
+        True once the daemon accepts connections, False on timeout or if
+        no private socket directory is available
+    """
+    path = socket_path(create=True)
+    if path is None:
+        return False
+    # The package root is a directory or, when run from a zipapp, the archive
+    root = str(Path(__file__).resolve().parent.parent)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+    subprocess.Popen(
+        [sys.executable, "-m", "src.daemon"],
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        if _accepts(path):
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def _handle(agent, conn: socket.socket):
+    """Serve one request inside a forked child."""
+    with conn.makefile("rb") as reader:
+        payload = json.loads(reader.readline())
+
+    if payload.get("command") == "stop":
+        conn.sendall(json.dumps({"stopped": True}).encode("utf-8"))
+        os.kill(os.getppid(), signal.SIGTERM)
+        return
+
+    config = agent.config
+    # Relative paths and the default working directory follow the client
+    if payload.get("cwd"):
+        os.chdir(payload["cwd"])
+        config.working_dir = Path(payload["cwd"])
+    if payload.get("model"):
+        from .config import ModelType
+        config.model = ModelType(payload["model"])
+    if payload.get("temperature") is not None:
+        config.temperature = payload["temperature"]
+    if payload.get("max_iterations"):
+        config.max_iterations = payload["max_iterations"]
+
+    response = agent.process_request(payload["query"], payload.get("context") or None)
+    conn.sendall(json.dumps({"response": response}).encode("utf-8"))
+    # The child exits with os._exit, so persist the session explicitly. The
+    # reply is already sent, so a failure here can only be logged.
+    try:
+        agent.flush_session()
+    except Exception as e:
+        agent.logger.error(f"Failed to save daemon session: {e}")
+
+
+def _reap_children(signum, frame):
+    """Collect exited request workers so they do not linger as zombies."""
+    try:
+        while os.waitpid(-1, os.WNOHANG)[0]:
+            pass
+    except ChildProcessError:
+        pass
+
+
+def _wake(signum, frame):
+    """Let SIGTERM reach the accept loop's wakeup socket instead of killing it."""
+
+
+def serve(config=None, agent=None):
+    """
+    Build the agent once, then fork a child per incoming request.
+
+    Args:
+        config: Configuration for the agent (defaults to ``Config()``)
+        agent: An already built agent to serve instead
+    """
+    if agent is None:
+        from .agent import Agent
+        agent = Agent(config)
+    path = socket_path(create=True)
+    if path is None:
+        raise RuntimeError("No private directory available for the daemon socket")
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+    # Reap workers as they exit. SIG_IGN would do this too, but forked
+    # workers would inherit it and every subprocess they wait on would
+    # then report exit status 0.
+    signal.signal(signal.SIGCHLD, _reap_children)
+    # SIGTERM (sent by stop()) is read from a wakeup socket rather than
+    # raised from a handler, which could fire inside a finalizer and be lost
+    wakeup, wakeup_write = socket.socketpair()
+    wakeup.setblocking(False)
+    wakeup_write.setblocking(False)
+    signal.set_wakeup_fd(wakeup_write.fileno())
+    signal.signal(signal.SIGTERM, _wake)
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server, wakeup, wakeup_write:
+        # Create the socket without group/other access from the start
+        umask = os.umask(0o077)
+        try:
+            server.bind(path)
+        finally:
+            os.umask(umask)
+        bound = os.lstat(path).st_ino
+        server.listen()
+        agent.logger.info(f"Agent daemon listening on {path}")
+
+        try:
+            _accept_loop(agent, server, wakeup)
+        finally:
+            signal.set_wakeup_fd(-1)
+            # Leave the path alone if a newer daemon has already replaced it
+            try:
+                if os.lstat(path).st_ino == bound:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+def _accept_loop(agent, server: socket.socket, wakeup: socket.socket):
+    """Fork a worker per connection until stopped or idle for too long."""
+    idle_timeout = agent.config.daemon_idle_timeout
+    deadline = time.monotonic() + idle_timeout if idle_timeout else None
+    while True:
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        ready, _, _ = select.select([server, wakeup], [], [], timeout)
+        if not ready:
+            agent.logger.info("Agent daemon idle, exiting")
+            return
+        if wakeup in ready:
+            try:
+                signals = wakeup.recv(512)
+            except BlockingIOError:
+                signals = b""
+            if signal.SIGTERM in signals:
+                agent.logger.info("Agent daemon stopped")
+                return
+        if server not in ready:
+            continue
+
+        conn, _ = server.accept()
+        if idle_timeout:
+            deadline = time.monotonic() + idle_timeout
+        if os.fork() == 0:
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            server.close()
+            wakeup.close()
+            try:
+                _handle(agent, conn)
+            except Exception as e:
+                conn.sendall(json.dumps({"error": str(e)}).encode("utf-8"))
+            finally:
+                conn.close()
+                os._exit(0)
+        conn.close()
+
+
+if __name__ == "__main__":
+    serve()
@@ -5,13 +5,20 @@ Logging Configuration and Management
 Provides comprehensive logging with multiple handlers, formatters, and levels.
 """
 
-import logging
+import os
 import sys
+import time
+import queue
+import atexit
+import logging
+import statistics
 from pathlib import Path
 from datetime import datetime
 from typing import Optional, Dict, Any
-from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
-import json
+from collections import Counter, defaultdict, deque
+from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler, QueueHandler, QueueListener
+
+from . import _json
 
 
 class ColoredFormatter(logging.Formatter):
@@ -31,26 +38,50 @@ class ColoredFormatter(logging.Formatter):
     BOLD = '\033[1m'
     
     def format(self, record):
-        # Add color to the level name
-        levelname = record.levelname
-        if levelname in self.COLORS:
-            record.levelname = f"{self.COLORS[levelname]}{self.BOLD}{levelname}{self.RESET}"
+        style = self._STYLES.get(record.levelname)
+        if style is None:
+            return super().format(record)
         
-        # Add color to the message based on level
-        if levelname in self.COLORS:
-            record.msg = f"{self.COLORS[levelname]}{record.msg}{self.RESET}"
-        
-        return super().format(record)
+        # Color the fields only while formatting, so other handlers (e.g. the
+        # log file) see the record unchanged
+        levelname, msg = record.levelname, record.msg
+        record.levelname = style[0]
+        record.msg = f"{style[1]}{msg}{self.RESET}"
+        try:
+            return super().format(record)
+        finally:
+            record.levelname, record.msg = levelname, msg
+
+
+# Colored level name and message color per level, built once
+ColoredFormatter._STYLES = {
+    level: (f"{color}{ColoredFormatter.BOLD}{level}{ColoredFormatter.RESET}", color)
+    for level, color in ColoredFormatter.COLORS.items()
+}
+
+
+# LogRecord attributes that are not user-supplied ``extra`` fields
+_RESERVED_ATTRS = frozenset({
+    'name', 'msg', 'args', 'created', 'filename', 'funcName', 'levelname',
+    'levelno', 'lineno', 'module', 'msecs', 'pathname', 'process',
+    'processName', 'relativeCreated', 'thread', 'threadName', 'taskName',
+    'exc_info', 'exc_text', 'stack_info',
+})
 
 
 class StructuredFormatter(logging.Formatter):
     """
     Formatter that outputs structured JSON logs.
+    
+    Timestamps are UTC in ISO 8601 with millisecond precision.
     """
     
     def format(self, record):
         log_obj = {
-            'timestamp': datetime.fromtimestamp(record.created).isoformat(),
+            'timestamp': (
+                f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))}"
+                f".{int(record.msecs):03d}Z"
+            ),
             'level': record.levelname,
             'logger': record.name,
             'message': record.getMessage(),
@@ -64,15 +95,58 @@ class StructuredFormatter(logging.Formatter):
             log_obj['exception'] = self.formatException(record.exc_info)
         
         # Add extra fields
-        for key, value in record.__dict__.items():
-            if key not in ['name', 'msg', 'args', 'created', 'filename', 
-                          'funcName', 'levelname', 'levelno', 'lineno', 
-                          'module', 'msecs', 'pathname', 'process', 
-                          'processName', 'relativeCreated', 'thread', 
-                          'threadName', 'exc_info', 'exc_text', 'stack_info']:
-                log_obj[key] = value
+        log_obj.update(
+            (key, value) for key, value in record.__dict__.items()
+            if key not in _RESERVED_ATTRS
+        )
         
-        return json.dumps(log_obj)
+        return _json.dumps(log_obj)
+
+
+class _BufferedRotatingFileHandler(RotatingFileHandler):
+    """
+    Rotating file handler that lets bursts of records share one write.
+    
+    Records below WARNING stay in a 64 KiB buffer instead of being flushed
+    one by one; _FlushingQueueListener flushes once the queue runs empty.
+    Set ``defer_flush`` to False to flush every record again.
+    """
+    
+    defer_flush = True
+    
+    def _open(self):
+        return open(
+            self.baseFilename, self.mode, buffering=1 << 16,
+            encoding=self.encoding, errors=self.errors
+        )
+    
+    def emit(self, record):
+        self._skip_flush = self.defer_flush and record.levelno < logging.WARNING
+        try:
+            super().emit(record)
+        finally:
+            self._skip_flush = False
+    
+    def flush(self):
+        if not getattr(self, "_skip_flush", False):
+            super().flush()
+
+
+class _FlushingQueueListener(QueueListener):
+    """QueueListener that flushes its handlers whenever the queue drains."""
+    
+    def dequeue(self, block):
+        if block and self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+        return super().dequeue(block)
+
+
+# Entries kept per error/warning/duration history in AgentLogger.metrics
+METRICS_HISTORY = 10_000
+
+# Stateless, so one instance serves every handler
+_STRUCTURED_FORMATTER = StructuredFormatter()
 
 
 class AgentLogger:
@@ -112,38 +186,42 @@ class AgentLogger:
             backup_count: Number of backup files to keep
         """
         self.logger = logging.getLogger(name)
-        self.logger.setLevel(getattr(logging, level.upper()))
+        level_no = logging.getLevelNamesMapping()[level.upper()]
+        self.logger.setLevel(level_no)
         self.logger.handlers = []  # Clear existing handlers
+        handlers = []
         
         # Console handler with colored output
         if enable_console:
             console_handler = logging.StreamHandler(sys.stdout)
-            console_handler.setLevel(getattr(logging, level.upper()))
+            console_handler.setLevel(level_no)
             
             if not enable_json:
-                console_format = ColoredFormatter(
+                # Colors are only worth rendering on a terminal
+                formatter_class = ColoredFormatter if sys.stdout.isatty() else logging.Formatter
+                console_format = formatter_class(
                     '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
                     datefmt='%Y-%m-%d %H:%M:%S'
                 )
             else:
-                console_format = StructuredFormatter()
+                console_format = _STRUCTURED_FORMATTER
             
             console_handler.setFormatter(console_format)
-            self.logger.addHandler(console_handler)
+            handlers.append(console_handler)
         
         # File handler with rotation
         if enable_file and log_file:
             log_file.parent.mkdir(parents=True, exist_ok=True)
             
-            file_handler = RotatingFileHandler(
+            file_handler = _BufferedRotatingFileHandler(
                 log_file,
                 maxBytes=max_bytes,
                 backupCount=backup_count
             )
-            file_handler.setLevel(getattr(logging, level.upper()))
+            file_handler.setLevel(level_no)
             
             if enable_json:
-                file_format = StructuredFormatter()
+                file_format = _STRUCTURED_FORMATTER
             else:
                 file_format = logging.Formatter(
                     '%(asctime)s - %(name)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s',
@@ -151,14 +229,30 @@ class AgentLogger:
                 )
             
             file_handler.setFormatter(file_format)
-            self.logger.addHandler(file_handler)
+            handlers.append(file_handler)
         
-        # Performance metrics
+        # Handlers run on a background thread; logging calls only enqueue
+        self._handlers = handlers
+        self._listener: Optional[QueueListener] = None
+        if handlers:
+            log_queue = queue.SimpleQueue()
+            self._queue_handler = QueueHandler(log_queue)
+            self.logger.addHandler(self._queue_handler)
+            self._listener = _FlushingQueueListener(log_queue, *handlers, respect_handler_level=True)
+            self._listener.start()
+            atexit.register(self._stop_listener)
+            if hasattr(os, "register_at_fork"):
+                os.register_at_fork(after_in_child=self._log_synchronously)
+        
+        # Performance metrics; event histories keep the most recent entries
+        # only, so long-running sessions don't grow them without bound
         self.metrics: Dict[str, Any] = {
-            'function_calls': {},
-            'errors': [],
-            'warnings': [],
-            'performance': {}
+            'function_calls': Counter(),
+            'errors': deque(maxlen=METRICS_HISTORY),
+            'warnings': deque(maxlen=METRICS_HISTORY),
+            'error_count': 0,
+            'warning_count': 0,
+            'performance': defaultdict(lambda: deque(maxlen=METRICS_HISTORY))
         }
     
     def get_logger(self) -> logging.Logger:
@@ -167,7 +261,15 @@ class AgentLogger:
     
     def log_function_call(self, function_name: str, args: Dict[str, Any], result: Any = None, duration: float = None):
         """Log a function call with arguments and result"""
-        self.metrics['function_calls'][function_name] = self.metrics['function_calls'].get(function_name, 0) + 1
+        self.metrics['function_calls'][function_name] += 1
+        
+        if duration is not None:
+            # Track performance metrics
+            self.metrics['performance'][function_name].append(duration)
+        
+        # Formatting args and result can be costly; skip it unless it is logged
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
         
         log_data = {
             'function': function_name,
@@ -179,11 +281,6 @@ class AgentLogger:
         
         if duration is not None:
             log_data['duration_ms'] = f"{duration * 1000:.2f}"
-            
-            # Track performance metrics
-            if function_name not in self.metrics['performance']:
-                self.metrics['performance'][function_name] = []
-            self.metrics['performance'][function_name].append(duration)
         
         self.logger.debug(f"Function call: {log_data}")
     
@@ -195,6 +292,7 @@ class AgentLogger:
             'context': context or {}
         }
         
+        self.metrics['error_count'] += 1
         self.metrics['errors'].append({
             'timestamp': datetime.now().isoformat(),
             **error_data
@@ -209,6 +307,7 @@ class AgentLogger:
             'details': details or {}
         }
         
+        self.metrics['warning_count'] += 1
         self.metrics['warnings'].append({
             'timestamp': datetime.now().isoformat(),
             **warning_data
@@ -231,10 +330,10 @@ class AgentLogger:
     def get_metrics_summary(self) -> Dict[str, Any]:
         """Get summary of logged metrics"""
         summary = {
-            'total_function_calls': sum(self.metrics['function_calls'].values()),
-            'function_call_breakdown': self.metrics['function_calls'],
-            'total_errors': len(self.metrics['errors']),
-            'total_warnings': len(self.metrics['warnings']),
+            'total_function_calls': self.metrics['function_calls'].total(),
+            'function_call_breakdown': dict(self.metrics['function_calls']),
+            'total_errors': self.metrics['error_count'],
+            'total_warnings': self.metrics['warning_count'],
             'performance_summary': {}
         }
         
@@ -243,7 +342,7 @@ class AgentLogger:
             if durations:
                 summary['performance_summary'][func_name] = {
                     'calls': len(durations),
-                    'avg_duration_ms': sum(durations) / len(durations) * 1000,
+                    'avg_duration_ms': statistics.fmean(durations) * 1000,
                     'min_duration_ms': min(durations) * 1000,
                     'max_duration_ms': max(durations) * 1000
                 }
@@ -252,17 +351,40 @@ class AgentLogger:
     
     def export_metrics(self, output_file: Path):
         """Export metrics to a file"""
-        with open(output_file, 'w') as f:
-            json.dump(self.get_metrics_summary(), f, indent=2)
+        with open(output_file, 'wb') as f:
+            f.write(_json.dumps_pretty(self.get_metrics_summary()))
         
         self.logger.info(f"Metrics exported to {output_file}")
 
+    def _stop_listener(self):
+        """Drain queued records and stop the background handler thread."""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+    
+    def _log_synchronously(self):
+        """
+        Attach the handlers directly, without the queue.
+        
+        Runs in forked children (e.g. daemon workers), which do not inherit
+        the listener thread and exit without running atexit hooks.
+        """
+        if self._listener is None:
+            return
+        self._listener = None
+        self.logger.removeHandler(self._queue_handler)
+        for handler in self._handlers:
+            if isinstance(handler, _BufferedRotatingFileHandler):
+                handler.defer_flush = False
+            self.logger.addHandler(handler)
+    
     def shutdown(self):
         """Shutdown the logger and close all handlers."""
-        for handler in self.logger.handlers:
-            if hasattr(handler, "close"):
-                handler.close()
+        self._stop_listener()
+        for handler in list(self.logger.handlers):
             self.logger.removeHandler(handler)
+        for handler in self._handlers:
+            handler.close()
 
 
 # Global logger instance
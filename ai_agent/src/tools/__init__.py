@@ -14,7 +14,10 @@ from .file_tools import (
     move_file,
     copy_file,
     list_files,
-    search_files
+    search_files,
+    file_hash,
+    read_file_async,
+    write_file_async
 )
 
 # from .code_tools import (
@@ -57,7 +60,8 @@ from .system_tools import (
 __all__ = [
     # File tools
     'read_file', 'write_file', 'create_file', 'delete_file',
-    'move_file', 'copy_file', 'list_files', 'search_files',
+    'move_file', 'copy_file', 'list_files', 'search_files', 'file_hash',
+    'read_file_async', 'write_file_async',
     
     # Code tools
     # 'analyze_code', 'format_code', 'lint_code', 'find_dependencies',
@@ -6,16 +6,47 @@ Comprehensive file operations with safety checks and error handling.
 '''
 
 import os
+import re
+import mmap
+import time
+import asyncio
+import errno
+import heapq
 import shutil
-import json
-import yaml
-# import toml  # Commented out to remove toml dependency
+import fnmatch
+import operator
+import functools
+import secrets
+from stat import S_ISDIR, S_ISREG
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional, Union
 from datetime import datetime
 import hashlib
 import mimetypes
-from google.genai import types
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+# copy_file_range errors that mean "use another copy method"
+_COPY_RANGE_UNSUPPORTED = frozenset({
+    errno.EXDEV, errno.ENOTSUP, errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL, errno.EBADF
+})
+
+# Files at least this large are memory-mapped by read_file instead of read
+_MMAP_THRESHOLD = 1024 * 1024
+
+# Matching lines reported per file by search_files
+_MAX_MATCHES_PER_FILE = 20
+
+# Leading bytes search_files checks for NUL to detect binary files
+_SNIFF_SIZE = 4096
+
+# Files search_files reads concurrently, and how many it hands out at a time
+_SEARCH_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+_SEARCH_BATCH = _SEARCH_WORKERS * 4
 
 
 def read_file(
@@ -42,7 +73,8 @@ def read_file(
     if not path.is_file():
         return {"error": f"Not a file: {file_path}"}
 
-    file_size = path.stat().st_size
+    stat = path.stat()
+    file_size = stat.st_size
     if max_size and file_size > max_size:
         return {
             "error": f"File too large: {file_size} bytes (max: {max_size} bytes)",
@@ -50,48 +82,97 @@ def read_file(
         }
 
     try:
-        with open(path, 'r', encoding=encoding) as f:
-            content = f.read()
+        # Read the bytes once; they are hex-encoded below if they don't decode
+        with open(path, 'rb') as f:
+            if file_size >= _MMAP_THRESHOLD:
+                # Decode straight from the page cache, skipping the copy into bytes
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = f.read()
+
+        try:
+            content = str(data, encoding)
+        except UnicodeDecodeError:
+            # Try reading as binary
+            with memoryview(data) as view:
+                hex_content = view.hex()
+            return {
+                "content": hex_content,
+                "file_path": str(path.absolute()),
+                "file_size": file_size,
+                "encoding": "binary",
+                "format": "hex"
+            }
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+        # Same newline handling as a text-mode read
+        if "\r" in content:
+            content = content.replace("\r\n", "\n").replace("\r", "\n")
 
         return {
             "content": content,
             "file_path": str(path.absolute()),
             "file_size": file_size,
             "encoding": encoding,
-            "lines": len(content.splitlines()),
-            "modified": datetime.fromtimestamp(path.stat().st_mtime).isoformat()
-        }
-    except UnicodeDecodeError:
-        # Try reading as binary
-        with open(path, 'rb') as f:
-            content = f.read()
-        return {
-            "content": content.hex(),
-            "file_path": str(path.absolute()),
-            "file_size": file_size,
-            "encoding": "binary",
-            "format": "hex"
+            # Counted without building a list of every line
+            "lines": content.count("\n") + (not content.endswith("\n") if content else 0),
+            "modified": datetime.fromtimestamp(stat.st_mtime).isoformat()
         }
     except Exception as e:
         return {"error": f"Failed to read file: {str(e)}"}
 
 
+def _copy_contents(src: Path, dst: Path):
+    """
+    Copy a file's bytes, letting the kernel do the work where it can.
+
+    os.copy_file_range copies without passing the data through user space
+    and can share blocks outright on reflink filesystems (Btrfs, XFS).
+    Where it is unavailable or refused (e.g. across filesystems) this falls
+    back to shutil.copyfile, which uses sendfile on Linux.
+    """
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                size = os.fstat(fsrc.fileno()).st_size
+                copied = 0
+                while copied < size:
+                    n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+            # Pseudo-files (e.g. /proc) report no size or yield no data here
+            if size and copied >= size:
+                return
+        except OSError as e:
+            if e.errno not in _COPY_RANGE_UNSUPPORTED:
+                raise
+    shutil.copyfile(src, dst)
+
+
 def write_file(
     file_path: Union[str, Path],
     content: str,
     encoding: str = 'utf-8',
     create_dirs: bool = True,
-    backup: bool = True
+    backup: bool = False,
+    sync: bool = False
 ) -> Dict[str, Any]:
     """
     Write content to a file with safety features.
 
+    The content goes to a temporary file in the same directory which then
+    atomically replaces the target, so readers never see a partial file.
+
     Args:
         file_path: Path to the file
         content: Content to write
         encoding: File encoding
         create_dirs: Create parent directories if they don't exist
         backup: Create backup of existing file
+        sync: Flush the content to disk before returning
 
     Returns:
         Dictionary with operation result
@@ -107,22 +188,92 @@ def write_file(
         backup_path = None
         if backup and path.exists():
             backup_path = path.with_suffix(path.suffix + '.bak')
-            shutil.copy2(path, backup_path)
+            _copy_contents(path, backup_path)
+            shutil.copystat(path, backup_path)
 
-        # Write the file
-        with open(path, 'w', encoding=encoding) as f:
-            f.write(content)
+        # Encode once; the bytes are both written and counted. Buffered
+        # writers pass payloads this large straight through to the kernel.
+        if os.linesep != "\n":
+            content = content.replace("\n", os.linesep)
+        data = content.encode(encoding)
+        _atomic_write(path, data, sync)
 
         return {
             "success": True,
             "file_path": str(path.absolute()),
-            "bytes_written": len(content.encode(encoding)),
+            "bytes_written": len(data),
             "backup_path": str(backup_path) if backup_path else None
         }
     except Exception as e:
         return {"error": f"Failed to write file: {str(e)}"}
 
 
+def _atomic_write(path: Path, data: bytes, sync: bool = False) -> None:
+    """
+    Write ``data`` to a temporary sibling of ``path`` and rename it over the target.
+
+    Args:
+        path: Destination file; a symlink is resolved so the link itself is kept
+        data: Bytes to write
+        sync: fsync the data before the rename so it survives a crash
+    """
+    target = path.resolve() if path.is_symlink() else path
+    # A random name per call lets concurrent writes to one path proceed.
+    # Creating it with 0o666 leaves the umask to set a new file's mode, as
+    # a plain open() would.
+    while True:
+        tmp = target.with_name(f".{target.name}.{secrets.token_hex(6)}.tmp")
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+            break
+        except FileExistsError:
+            continue
+    try:
+        try:
+            if target.exists():
+                shutil.copymode(target, tmp)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            if sync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp, target)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+async def read_file_async(file_path: Union[str, Path], **kwargs) -> Dict[str, Any]:
+    """
+    Async read_file: runs in a worker thread so several reads can overlap.
+
+    Args:
+        file_path: Path to the file
+        **kwargs: Further read_file arguments
+
+    Returns:
+        Same as read_file
+    """
+    return await asyncio.to_thread(read_file, file_path, **kwargs)
+
+
+async def write_file_async(file_path: Union[str, Path], content: str, **kwargs) -> Dict[str, Any]:
+    """
+    Async write_file: runs in a worker thread so several writes can overlap.
+
+    Args:
+        file_path: Path to the file
+        content: Content to write
+        **kwargs: Further write_file arguments
+
+    Returns:
+        Same as write_file
+    """
+    return await asyncio.to_thread(write_file, file_path, content, **kwargs)
+
+
 def create_file(
     file_path: Union[str, Path],
     content: str = "",
@@ -226,7 +377,18 @@ def move_file(
         # Ensure destination directory exists
         dst_path.parent.mkdir(parents=True, exist_ok=True)
 
-        shutil.move(str(src_path), str(dst_path))
+        if src_path.is_file() and not dst_path.is_dir():
+            try:
+                os.replace(src_path, dst_path)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # Across filesystems: in-kernel copy, then drop the source
+                _copy_contents(src_path, dst_path)
+                shutil.copystat(src_path, dst_path)
+                src_path.unlink()
+        else:
+            shutil.move(str(src_path), str(dst_path))
 
         return {
             "success": True,
@@ -268,10 +430,15 @@ def copy_file(
         # Ensure destination directory exists
         dst_path.parent.mkdir(parents=True, exist_ok=True)
 
+        # Like shutil.copy, a directory destination receives the file by name
+        if dst_path.is_dir():
+            dst_path = dst_path / src_path.name
+
+        _copy_contents(src_path, dst_path)
         if preserve_metadata:
-            shutil.copy2(str(src_path), str(dst_path))
+            shutil.copystat(src_path, dst_path)
         else:
-            shutil.copy(str(src_path), str(dst_path))
+            shutil.copymode(src_path, dst_path)
 
         return {
             "success": True,
@@ -282,6 +449,141 @@ def copy_file(
         return {"error": f"Failed to copy file: {str(e)}"}
 
 
+@functools.lru_cache(maxsize=4096)
+def _file_digest(
+    path: str,
+    algorithm: str,
+    dev: int,
+    ino: int,
+    size: int,
+    mtime_ns: int,
+    ctime_ns: int
+) -> str:
+    """
+    Hex digest of a file, memoized on its identity and change times.
+
+    Any write changes the size or a timestamp (and a replaced file has a new
+    inode), so a changed file misses the cache and is hashed again.
+    """
+    if algorithm == "blake3":
+        # blake3 hashes the mapped file with multiple threads
+        return blake3.blake3(max_threads=blake3.blake3.AUTO).update_mmap(path).hexdigest()
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, algorithm).hexdigest()
+
+
+def file_hash(
+    file_path: Union[str, Path],
+    algorithm: str = "sha256"
+) -> Dict[str, Any]:
+    """
+    Compute a checksum of a file's contents.
+
+    SHA-256 goes through OpenSSL (hardware-accelerated where the CPU
+    supports it). "blake3" is faster on large files but needs the optional
+    ``blake3`` package; any other hashlib algorithm name also works.
+
+    Args:
+        file_path: Path to the file
+        algorithm: Hash algorithm (default: sha256)
+
+    Returns:
+        Dictionary with the hex digest and file metadata
+    """
+    path = Path(file_path).absolute()
+
+    try:
+        stat = path.stat()
+    except OSError:
+        stat = None
+    if stat is None or not S_ISREG(stat.st_mode):
+        return {"error": f"File not found: {file_path}"}
+
+    if algorithm == "blake3" and blake3 is None:
+        return {"error": "blake3 is not installed; use sha256 or install blake3"}
+
+    try:
+        digest = _file_digest(
+            str(path), algorithm,
+            stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns
+        )
+
+        return {
+            "file_path": str(path),
+            "algorithm": algorithm,
+            "hash": digest,
+            "file_size": stat.st_size
+        }
+    except ValueError:
+        return {"error": f"Unsupported hash algorithm: {algorithm}"}
+    except Exception as e:
+        return {"error": f"Failed to hash file: {str(e)}"}
+
+
+def _scan_directory(
+    root: str,
+    pattern: str,
+    recursive: bool,
+    include_hidden: bool
+) -> List[os.DirEntry]:
+    """
+    Collect directory entries whose names match ``pattern``.
+
+    Uses os.scandir, whose entries carry their file type from the directory
+    read, so no per-entry stat is needed here. Hidden directories are only
+    descended into when ``include_hidden`` is set; symlinked directories are
+    not followed. Unreadable subdirectories are skipped.
+    """
+    matches = []
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if not include_hidden and entry.name.startswith('.'):
+                        continue
+                    if fnmatch.fnmatch(entry.name, pattern):
+                        matches.append(entry)
+                    if recursive and entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+        except OSError:
+            continue
+    return matches
+
+
+@functools.lru_cache(maxsize=512)
+def _mime_for_suffix(suffix: str) -> str:
+    """MIME type for a lower-cased file extension."""
+    return mimetypes.guess_type("f" + suffix)[0] or "unknown"
+
+
+def _mime_type(name: str) -> str:
+    """
+    Guess a file's MIME type, memoized per extension.
+
+    Compression suffixes (e.g. ``.tar.gz``) take their type from the inner
+    extension, so those names go through mimetypes in full.
+    """
+    suffix = os.path.splitext(name)[1].lower()
+    if suffix in mimetypes.encodings_map:
+        return mimetypes.guess_type(name)[0] or "unknown"
+    return _mime_for_suffix(suffix)
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_mtime(seconds: int) -> str:
+    """Local ISO 8601 time of a whole-second timestamp; files modified together share it."""
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(seconds))
+
+
+def _stat_field(entry: Union[os.DirEntry, Path], field: str) -> float:
+    """Read one stat field for sorting, treating broken links as 0."""
+    try:
+        return getattr(entry.stat(), field)
+    except OSError:
+        return 0
+
+
 def list_files(
     directory: Union[str, Path] = ".",
     pattern: str = "*",
@@ -315,15 +617,16 @@ def list_files(
         return {"error": f"Not a directory: {directory}"}
 
     try:
-        # Get files based on pattern
-        if recursive:
-            files = list(dir_path.rglob(pattern))
+        # Resolve against the cwd once; scandir entries carry full paths
+        # built from it, so no per-entry absolute() is needed
+        root = dir_path.absolute()
+        if "/" in pattern or os.sep in pattern:
+            # Patterns with directory parts need glob's per-component matching
+            files = list(root.rglob(pattern) if recursive else root.glob(pattern))
+            if not include_hidden:
+                files = [f for f in files if not f.name.startswith('.')]
         else:
-            files = list(dir_path.glob(pattern))
-
-        # Filter hidden files
-        if not include_hidden:
-            files = [f for f in files if not f.name.startswith('.')]
+            files = _scan_directory(str(root), pattern, recursive, include_hidden)
 
         # Filter by type
         if file_type == "file":
@@ -333,16 +636,15 @@ def list_files(
         elif file_type == "link":
             files = [f for f in files if f.is_symlink()]
 
-        # Sort files
+        # Sort and limit in one pass: a heap of `limit` entries instead of a
+        # full sort. os.DirEntry caches its stat, so the listing below reuses it.
+        count = len(files) if limit is None else limit
         if sort_by == "size":
-            files.sort(key=lambda f: f.stat().st_size if f.exists() else 0, reverse=True)
+            files = heapq.nlargest(count, files, key=functools.partial(_stat_field, field="st_size"))
         elif sort_by == "modified":
-            files.sort(key=lambda f: f.stat().st_mtime if f.exists() else 0, reverse=True)
+            files = heapq.nlargest(count, files, key=functools.partial(_stat_field, field="st_mtime"))
         else:  # name
-            files.sort(key=lambda f: f.name)
-
-        # Limit results
-        files = files[:limit]
+            files = heapq.nsmallest(count, files, key=operator.attrgetter("name"))
 
         # Prepare file information
         file_list = []
@@ -351,22 +653,24 @@ def list_files(
                 stat = file_path.stat()
                 file_info = {
                     "name": file_path.name,
-                    "path": str(file_path.absolute()),
+                    "path": os.fspath(file_path),
                     "size": stat.st_size,
-                    "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                    "type": "file" if file_path.is_file() else "dir" if file_path.is_dir() else "link",
-                    "mime_type": mimetypes.guess_type(file_path)[0] or "unknown"
+                    "modified": _format_mtime(int(stat.st_mtime)),
+                    # From the stat already in hand: no is_file()/is_dir()
+                    # syscalls for the Path entries of glob patterns
+                    "type": "file" if S_ISREG(stat.st_mode) else "dir" if S_ISDIR(stat.st_mode) else "link",
+                    "mime_type": _mime_type(file_path.name)
                 }
                 file_list.append(file_info)
             except OSError as e:
                 # Handle potential permission issues or broken links
-                print(f"Error accessing file {file_path}: {e}")
+                print(f"Error accessing file {os.fspath(file_path)}: {e}")
                 continue
 
         return {
             "files": file_list,
             "count": len(file_list),
-            "directory": str(dir_path.absolute()),
+            "directory": str(root),
             "pattern": pattern,
             "recursive": recursive,
             "include_hidden": include_hidden,
@@ -378,15 +682,194 @@ def list_files(
         return {"error": f"Failed to list files: {str(e)}"}
 
 
-def search_files(directory: str = ".", pattern: str = "*") -> Dict[str, Any]:
+def _matching_lines(data: Union[bytes, mmap.mmap], regex: "re.Pattern[bytes]") -> List[Dict[str, Any]]:
     """
-    Searches for files in a directory matching a given pattern.
+    Find the lines of ``data`` that contain a match of ``regex``.
+
+    Works on the raw bytes: only the matching lines are located (by searching
+    for the surrounding newlines) and decoded, never the whole file.
+    """
+    matches = []
+    line_number = 1
+    counted_to = 0
+    pos = 0
+    while len(matches) < _MAX_MATCHES_PER_FILE:
+        match = regex.search(data, pos)
+        if match is None:
+            break
+        start = data.rfind(b"\n", 0, match.start()) + 1
+        end = data.find(b"\n", match.start())
+        if end == -1:
+            end = len(data)
+        # mmap has no count(); slicing it (or bytes) yields bytes, and each
+        # stretch of the file is counted only once
+        line_number += data[counted_to:start].count(b"\n")
+        counted_to = start
+        line = data[start:end].decode('utf-8', errors='replace')
+        matches.append({"line": line_number, "content": line.strip()[:200]})
+        # One entry per line: continue after it
+        pos = end + 1
+    return matches
+
+
+def _scan_file(
+    entry: os.DirEntry,
+    regex: "re.Pattern[bytes]",
+    max_file_size: int
+) -> List[Dict[str, Any]]:
+    """
+    Matching lines of one file; unreadable, empty, oversized and binary
+    files have none.
+
+    The size comes from fstat on the open file, so no separate path stat
+    is made. A NUL byte in the first page marks a file as binary, which is
+    then skipped without reading the rest.
+    """
+    try:
+        with open(entry.path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size > max_file_size or size == 0:
+                return []
+            head = f.read(_SNIFF_SIZE)
+            if b"\0" in head:
+                return []
+            if size >= _MMAP_THRESHOLD:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return _matching_lines(data, regex)
+            return _matching_lines(head + f.read() if len(head) == _SNIFF_SIZE else head, regex)
+    except (OSError, ValueError):
+        # Unreadable, or truncated while being mapped
+        return []
+
+
+def _search_contents(
+    entries: List[os.DirEntry],
+    regex: "re.Pattern[bytes]",
+    max_results: int,
+    max_file_size: int
+) -> List[Dict[str, Any]]:
+    """
+    Content-search files concurrently, keeping their order.
+
+    Reads release the GIL, so several files are read at once. Files are
+    handed out in batches so the search stops soon after ``max_results``
+    files have matched.
+    """
+    results = []
+    if len(entries) <= 1:
+        batches = [entries]
+        pool = None
+    else:
+        batches = [
+            entries[start:start + _SEARCH_BATCH]
+            for start in range(0, len(entries), _SEARCH_BATCH)
+        ]
+        pool = ThreadPoolExecutor(max_workers=_SEARCH_WORKERS, thread_name_prefix="search")
+    try:
+        scan = functools.partial(_scan_file, regex=regex, max_file_size=max_file_size)
+        for batch in batches:
+            scanned = pool.map(scan, batch) if pool else map(scan, batch)
+            for entry, matches in zip(batch, scanned):
+                if matches:
+                    results.append({"file": entry.path, "matches": matches})
+                    if len(results) >= max_results:
+                        return results
+        return results
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+def search_files(
+    directory: Union[str, Path] = ".",
+    pattern: str = "*",
+    content_pattern: Optional[str] = None,
+    name_pattern: Optional[str] = None,
+    file_extensions: Optional[List[str]] = None,
+    recursive: bool = True,
+    case_sensitive: bool = False,
+    max_results: int = 100,
+    max_file_size: int = 1024 * 1024  # 1MB default
+) -> Dict[str, Any]:
+    """
+    Search for files by name and/or content.
 
     Args:
-        directory: The directory to search in.
-        pattern: The file pattern to search for.
+        directory: Directory to search in
+        pattern: Glob pattern file names must match
+        content_pattern: Text the file content must contain
+        name_pattern: Text the file name must contain
+        file_extensions: Only search files with these extensions (e.g. ["py", ".md"])
+        recursive: Search subdirectories
+        case_sensitive: Match content_pattern and name_pattern case-sensitively
+        max_results: Maximum number of files to return
+        max_file_size: Larger files are skipped by the content search (in bytes)
 
     Returns:
-        A dictionary containing the list of files found.
+        Dictionary with matching files and, for content searches, their
+        matching lines
     """
-    return list_files(directory=directory, pattern=pattern)
+    dir_path = Path(directory)
+
+    if not dir_path.exists():
+        return {"error": f"Directory not found: {directory}"}
+
+    if not dir_path.is_dir():
+        return {"error": f"Not a directory: {directory}"}
+
+    def fold(text: str) -> str:
+        return text if case_sensitive else text.lower()
+
+    extensions = tuple(
+        fold("." + ext.lstrip(".")) for ext in file_extensions
+    ) if file_extensions else None
+    name_needle = fold(name_pattern) if name_pattern else None
+    content_regex = None
+    if content_pattern:
+        # Byte-level matching; re folds case for ASCII only, so non-ASCII
+        # patterns also match their lower- and upper-case forms explicitly
+        if case_sensitive or content_pattern.isascii():
+            needle = re.escape(content_pattern.encode('utf-8'))
+        else:
+            needle = b"|".join({
+                re.escape(variant.encode('utf-8'))
+                for variant in (content_pattern, content_pattern.lower(),
+                                content_pattern.upper(), content_pattern.casefold())
+            })
+        content_regex = re.compile(needle, 0 if case_sensitive else re.IGNORECASE)
+
+    try:
+        root = dir_path.absolute()
+        entries = sorted(
+            _scan_directory(str(root), pattern, recursive, include_hidden=False),
+            key=operator.attrgetter("path")
+        )
+
+        candidates = []
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            name = fold(entry.name)
+            if extensions and not name.endswith(extensions):
+                continue
+            if name_needle and name_needle not in name:
+                continue
+            candidates.append(entry)
+
+        if content_regex is None:
+            results = [{"file": entry.path} for entry in candidates[:max_results]]
+        else:
+            results = _search_contents(candidates, content_regex, max_results, max_file_size)
+
+        return {
+            "results": results,
+            "results_count": len(results),
+            "directory": str(root),
+            "pattern": pattern,
+            "content_pattern": content_pattern,
+            "name_pattern": name_pattern,
+            "file_extensions": file_extensions,
+            "recursive": recursive
+        }
+    except Exception as e:
+        return {"error": f"Failed to search files: {str(e)}"}
@@ -6,19 +6,68 @@ Tools for system operations, command execution, and resource monitoring.
 """
 
 import os
-import sys
 import subprocess
 import platform
 import psutil
-import json
+import re
+import shlex
 import signal
 import time
-from pathlib import Path
-from typing import Dict, Any, Optional, List, Union
+import threading
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Any, Optional, Tuple
 from datetime import datetime
 from google.genai import types
 
 
+# Chunk size for draining a command's output pipes
+_PIPE_CHUNK = 64 * 1024
+
+# Seconds to wait for output readers once a command has exited
+_READER_GRACE = 5.0
+
+
+def _drain_pipe(stream, limit: int, out: Dict[str, Any]) -> None:
+    """
+    Read a pipe to EOF, keeping only about its last ``limit`` bytes.
+    
+    Args:
+        stream: Binary pipe to read
+        limit: Number of trailing bytes to keep
+        out: Dict whose "chunks" deque and "truncated" flag are updated as
+            data arrives, so a partial read is usable if the pipe never closes
+    """
+    chunks = out["chunks"]
+    size = 0
+    with stream:
+        for chunk in iter(lambda: stream.read1(_PIPE_CHUNK), b""):
+            chunks.append(chunk)
+            size += len(chunk)
+            while len(chunks) > 1 and size - len(chunks[0]) >= limit:
+                size -= len(chunks.popleft())
+                out["truncated"] = True
+
+
+def _pipe_tail(out: Dict[str, Any], limit: int) -> Tuple[bytes, bool]:
+    """Join what _drain_pipe has read so far, cut to the last ``limit`` bytes."""
+    data = b"".join(list(out["chunks"]))
+    if len(data) > limit:
+        return data[-limit:], True
+    return data, out["truncated"]
+
+
+def _kill_process_tree(proc: subprocess.Popen) -> None:
+    """Kill a command started by run_command along with its children."""
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
 def run_command(
     command: str,
     shell: bool = True,
@@ -26,7 +75,9 @@ def run_command(
     working_dir: Optional[str] = None,
     env: Optional[Dict[str, str]] = None,
     capture_output: bool = True,
-    check: bool = False
+    check: bool = False,
+    max_output_bytes: int = 1024 * 1024,
+    text: bool = True
 ) -> Dict[str, Any]:
     """
     Execute a system command with safety features.
@@ -39,36 +90,86 @@ def run_command(
         env: Environment variables
         capture_output: Whether to capture command output
         check: Whether to raise exception on non-zero exit code
+        max_output_bytes: Bytes of stdout and of stderr to keep; earlier output is dropped
+        text: Whether to decode output to str; if False, stdout and stderr are bytes
     
     Returns:
         Dictionary with command result
     """
     try:
-        # Prepare environment
-        cmd_env = os.environ.copy()
+        # Prepare environment; without overrides the child inherits ours
+        cmd_env = None
         if env:
-            cmd_env.update(env)
+            cmd_env = {**os.environ, **env}
         
-        # Execute command
-        result = subprocess.run(
+        # Execute command in its own process group so a timeout can stop
+        # everything it started; it stays in our session, so it keeps the
+        # controlling terminal
+        pipe = subprocess.PIPE if capture_output else None
+        proc = subprocess.Popen(
             command,
             shell=shell,
-            timeout=timeout,
             cwd=working_dir,
             env=cmd_env,
-            capture_output=capture_output,
-            text=True,
-            check=check
+            stdout=pipe,
+            stderr=pipe,
+            bufsize=_PIPE_CHUNK,
+            process_group=0 if os.name == "posix" else None
         )
         
-        return {
-            "success": result.returncode == 0,
+        # Drain both pipes concurrently, keeping only the tail of each
+        readers = []
+        outputs = ({"chunks": deque(), "truncated": False},
+                   {"chunks": deque(), "truncated": False})
+        if capture_output:
+            for stream, out in zip((proc.stdout, proc.stderr), outputs):
+                reader = threading.Thread(
+                    target=_drain_pipe, args=(stream, max_output_bytes, out), daemon=True
+                )
+                reader.start()
+                readers.append(reader)
+        
+        try:
+            proc.wait(timeout=timeout)
+        except BaseException:
+            _kill_process_tree(proc)
+            proc.wait()
+            raise
+        finally:
+            # Give the readers a shared grace period to reach EOF
+            deadline = time.monotonic() + _READER_GRACE
+            for reader in readers:
+                reader.join(timeout=max(0.0, deadline - time.monotonic()))
+        
+        stdout = stderr = None
+        truncated = False
+        if capture_output:
+            # A reader can still be blocked here if a background child holds
+            # the pipe open; use what it has read and report the rest as cut
+            (stdout, out_cut), (stderr, err_cut) = (
+                _pipe_tail(out, max_output_bytes) for out in outputs
+            )
+            if any(reader.is_alive() for reader in readers):
+                out_cut = err_cut = True
+            if text:
+                stdout = stdout.decode(errors="replace")
+                stderr = stderr.decode(errors="replace")
+            truncated = out_cut or err_cut
+        
+        if check and proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, command, stdout, stderr)
+        
+        result = {
+            "success": proc.returncode == 0,
             "command": command,
-            "exit_code": result.returncode,
-            "stdout": result.stdout if capture_output else None,
-            "stderr": result.stderr if capture_output else None,
+            "exit_code": proc.returncode,
+            "stdout": stdout,
+            "stderr": stderr,
             "working_dir": working_dir or os.getcwd()
         }
+        if truncated:
+            result["output_truncated"] = True
+        return result
     
     except subprocess.TimeoutExpired:
         return {
@@ -91,6 +192,53 @@ def run_command(
         }
 
 
+@lru_cache(maxsize=1)
+def _platform_info() -> Dict[str, str]:
+    """Platform details, which do not change while the process runs."""
+    return {
+        "system": platform.system(),
+        "node": platform.node(),
+        "release": platform.release(),
+        "version": platform.version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "python_version": platform.python_version()
+    }
+
+
+@lru_cache(maxsize=2)
+def _cpu_count(logical: bool) -> Optional[int]:
+    """Number of physical or logical CPU cores."""
+    return psutil.cpu_count(logical=logical)
+
+
+@lru_cache(maxsize=1)
+def _boot_time() -> datetime:
+    """Time the system booted, which is fixed for the life of the process."""
+    return datetime.fromtimestamp(psutil.boot_time())
+
+
+# Shortest window a CPU usage reading may cover. psutil measures usage since
+# its previous reading by any caller, so a reading closer than this to the
+# last one samples for this long instead.
+_MIN_CPU_WINDOW = 0.1
+
+# Prime psutil's CPU counters so later readings need not block
+psutil.cpu_percent(interval=None)
+_cpu_sampled_at = time.monotonic()
+
+
+def _cpu_percent() -> float:
+    """System-wide CPU usage since the previous reading, over at least _MIN_CPU_WINDOW."""
+    global _cpu_sampled_at
+    if time.monotonic() - _cpu_sampled_at < _MIN_CPU_WINDOW:
+        value = psutil.cpu_percent(interval=_MIN_CPU_WINDOW)
+    else:
+        value = psutil.cpu_percent(interval=None)
+    _cpu_sampled_at = time.monotonic()
+    return value
+
+
 def get_system_info() -> Dict[str, Any]:
     """
     Get comprehensive system information.
@@ -101,26 +249,20 @@ def get_system_info() -> Dict[str, Any]:
     try:
         # Basic system info
         info = {
-            "platform": {
-                "system": platform.system(),
-                "node": platform.node(),
-                "release": platform.release(),
-                "version": platform.version(),
-                "machine": platform.machine(),
-                "processor": platform.processor(),
-                "python_version": platform.python_version()
-            }
+            "platform": dict(_platform_info())
         }
         
         # CPU information
+        freq = psutil.cpu_freq()
         info["cpu"] = {
-            "physical_cores": psutil.cpu_count(logical=False),
-            "logical_cores": psutil.cpu_count(logical=True),
-            "usage_percent": psutil.cpu_percent(interval=1),
+            "physical_cores": _cpu_count(False),
+            "logical_cores": _cpu_count(True),
+            # Usage since the previous reading, sampling briefly if that was too recent
+            "usage_percent": _cpu_percent(),
             "frequency": {
-                "current": psutil.cpu_freq().current if psutil.cpu_freq() else None,
-                "min": psutil.cpu_freq().min if psutil.cpu_freq() else None,
-                "max": psutil.cpu_freq().max if psutil.cpu_freq() else None
+                "current": freq.current if freq else None,
+                "min": freq.min if freq else None,
+                "max": freq.max if freq else None
             }
         }
         
@@ -160,13 +302,19 @@ def get_system_info() -> Dict[str, Any]:
         }
         
         # Process information
+        # One pass over the process table yields both counts
+        total = running = 0
+        for proc in psutil.process_iter(['status']):
+            total += 1
+            if proc.info['status'] == psutil.STATUS_RUNNING:
+                running += 1
         info["processes"] = {
-            "total": len(psutil.pids()),
-            "running": len([p for p in psutil.process_iter(['status']) if p.info['status'] == psutil.STATUS_RUNNING])
+            "total": total,
+            "running": running
         }
         
         # Boot time
-        boot_time = datetime.fromtimestamp(psutil.boot_time())
+        boot_time = _boot_time()
         info["boot_time"] = boot_time.isoformat()
         info["uptime_seconds"] = (datetime.now() - boot_time).total_seconds()
         
@@ -178,7 +326,8 @@ def get_system_info() -> Dict[str, Any]:
 
 def monitor_resources(
     duration: int = 5,
-    interval: float = 1.0
+    interval: float = 1.0,
+    keep_samples: bool = False
 ) -> Dict[str, Any]:
     """
     Monitor system resources over a period of time.
@@ -186,56 +335,90 @@ def monitor_resources(
     Args:
         duration: Monitoring duration in seconds
         interval: Sampling interval in seconds
+        keep_samples: Whether to return every sample rather than just the last one
     
     Returns:
         Dictionary with resource usage statistics
     """
+    if interval <= 0:
+        return {"error": "Sampling interval must be positive"}
+    
     try:
         samples = []
-        start_time = time.time()
+        sample = None
+        count = 0
+        cpu_min = memory_min = float("inf")
+        cpu_max = memory_max = float("-inf")
+        cpu_sum = memory_sum = 0.0
+        # Sleep until each sample's scheduled time so the time spent
+        # sampling does not accumulate as drift
+        start_time = time.monotonic()
+        deadline = start_time + duration
+        next_time = start_time
         
-        while time.time() - start_time < duration:
+        while next_time < deadline and time.monotonic() < deadline:
+            disk_io = psutil.disk_io_counters()
             sample = {
                 "timestamp": datetime.now().isoformat(),
-                "cpu_percent": psutil.cpu_percent(),
+                "cpu_percent": _cpu_percent(),
                 "memory_percent": psutil.virtual_memory().percent,
-                "disk_io": psutil.disk_io_counters()._asdict() if psutil.disk_io_counters() else {},
+                "disk_io": disk_io._asdict() if disk_io else {},
                 "network_io": psutil.net_io_counters()._asdict()
             }
-            samples.append(sample)
-            time.sleep(interval)
+            if keep_samples:
+                samples.append(sample)
+            
+            # Keep running statistics instead of a list of every reading
+            cpu, memory = sample["cpu_percent"], sample["memory_percent"]
+            count += 1
+            cpu_sum += cpu
+            memory_sum += memory
+            cpu_min, cpu_max = min(cpu_min, cpu), max(cpu_max, cpu)
+            memory_min, memory_max = min(memory_min, memory), max(memory_max, memory)
+            
+            next_time = start_time + count * interval
+            delay = next_time - time.monotonic()
+            if next_time < deadline and delay > 0:
+                time.sleep(delay)
         
-        # Calculate statistics
-        cpu_values = [s["cpu_percent"] for s in samples]
-        memory_values = [s["memory_percent"] for s in samples]
+        if not count:
+            return {"error": "No samples collected; duration must be positive"}
         
-        return {
+        result = {
             "duration": duration,
-            "samples_count": len(samples),
+            "samples_count": count,
             "statistics": {
                 "cpu": {
-                    "min": min(cpu_values),
-                    "max": max(cpu_values),
-                    "average": sum(cpu_values) / len(cpu_values)
+                    "min": cpu_min,
+                    "max": cpu_max,
+                    "average": cpu_sum / count
                 },
                 "memory": {
-                    "min": min(memory_values),
-                    "max": max(memory_values),
-                    "average": sum(memory_values) / len(memory_values)
+                    "min": memory_min,
+                    "max": memory_max,
+                    "average": memory_sum / count
                 }
             },
-            "samples": samples
+            "last_sample": sample
         }
+        if keep_samples:
+            result["samples"] = samples
+        return result
     
     except Exception as e:
         return {"error": f"Failed to monitor resources: {str(e)}"}
 
 
+# Most processes manage_processes("list") returns
+_PROCESS_LIST_LIMIT = 50
+
+
 def manage_processes(
     action: str,
     process_name: Optional[str] = None,
     pid: Optional[int] = None,
-    signal_type: str = "TERM"
+    signal_type: str = "TERM",
+    detailed: bool = False
 ) -> Dict[str, Any]:
     """
     Manage system processes.
@@ -245,6 +428,7 @@ def manage_processes(
         process_name: Process name to search for
         pid: Process ID
         signal_type: Signal type for kill action (TERM, KILL, INT)
+        detailed: Whether the info action also counts network connections
     
     Returns:
         Dictionary with operation result
@@ -252,17 +436,19 @@ def manage_processes(
     try:
         if action == "list":
             # List all processes
+            # Count from the cheap PID list and read attributes only for the
+            # processes that are returned
+            count = len(psutil.pids())
             processes = []
             for proc in psutil.process_iter(['pid', 'name', 'username', 'cpu_percent', 'memory_percent', 'status']):
-                try:
-                    processes.append(proc.info)
-                except (psutil.NoSuchProcess, psutil.AccessDenied):
-                    continue
+                processes.append(proc.info)
+                if len(processes) >= _PROCESS_LIST_LIMIT:
+                    break
             
             return {
                 "action": "list",
-                "count": len(processes),
-                "processes": processes[:50]  # Limit to 50 processes
+                "count": count,
+                "processes": processes
             }
         
         elif action == "find":
@@ -270,11 +456,22 @@ def manage_processes(
             if not process_name:
                 return {"error": "Process name required for find action"}
             
+            # Match on the cheap name attribute first, then collect the
+            # expensive details only for the processes that matched
+            match = re.compile(re.escape(process_name), re.IGNORECASE).search
+            pids = [
+                proc.info['pid'] for proc in psutil.process_iter(['pid', 'name'])
+                if match(proc.info['name'] or "")
+            ]
+
             matching = []
-            for proc in psutil.process_iter(['pid', 'name', 'cmdline', 'username', 'cpu_percent', 'memory_percent']):
+            for match_pid in pids:
                 try:
-                    if process_name.lower() in proc.info['name'].lower():
-                        matching.append(proc.info)
+                    proc = psutil.Process(match_pid)
+                    with proc.oneshot():
+                        matching.append(proc.as_dict(attrs=[
+                            'pid', 'name', 'cmdline', 'username', 'cpu_percent', 'memory_percent'
+                        ]))
                 except (psutil.NoSuchProcess, psutil.AccessDenied):
                     continue
             
@@ -292,20 +489,26 @@ def manage_processes(
             
             try:
                 proc = psutil.Process(pid)
-                info = {
-                    "pid": proc.pid,
-                    "name": proc.name(),
-                    "status": proc.status(),
-                    "username": proc.username(),
-                    "create_time": datetime.fromtimestamp(proc.create_time()).isoformat(),
-                    "cpu_percent": proc.cpu_percent(),
-                    "memory_percent": proc.memory_percent(),
-                    "memory_info": proc.memory_info()._asdict(),
-                    "num_threads": proc.num_threads(),
-                    "cmdline": ' '.join(proc.cmdline()),
-                    "cwd": proc.cwd(),
-                    "connections": len(proc.connections())
-                }
+                # oneshot() reads each /proc file once for all the fields below
+                with proc.oneshot():
+                    info = {
+                        "pid": proc.pid,
+                        "name": proc.name(),
+                        "status": proc.status(),
+                        "username": proc.username(),
+                        "create_time": datetime.fromtimestamp(proc.create_time()).isoformat(),
+                        "cpu_percent": proc.cpu_percent(),
+                        "memory_percent": proc.memory_percent(),
+                        "memory_info": proc.memory_info()._asdict(),
+                        "num_threads": proc.num_threads(),
+                        "cmdline": ' '.join(proc.cmdline()),
+                        "cwd": proc.cwd()
+                    }
+                    if detailed:
+                        # Parsing the socket tables is the costliest read here;
+                        # net_connections() replaced connections() in psutil 6
+                        connections = getattr(proc, "net_connections", None) or proc.connections
+                        info["connections"] = len(connections(kind="inet"))
                 
                 return {
                     "action": "info",
@@ -390,8 +593,8 @@ def schedule_task(
                     return {"error": "Schedule time required for 'at' scheduling"}
                 
                 proc = subprocess.run(
-                    f"echo '{command}' | at {schedule_time}",
-                    shell=True,
+                    ["at", *shlex.split(schedule_time)],
+                    input=command + "\n",
                     capture_output=True,
                     text=True
                 )
@@ -412,22 +615,24 @@ def schedule_task(
                 
                 # Get current crontab
                 proc = subprocess.run(
-                    "crontab -l",
-                    shell=True,
+                    ["crontab", "-l"],
                     capture_output=True,
                     text=True
                 )
                 
                 current_cron = proc.stdout if proc.returncode == 0 else ""
+                if current_cron and not current_cron.endswith("\n"):
+                    current_cron += "\n"
                 
                 # Add new entry
                 new_entry = f"{cron_expression} {command}"
-                new_cron = current_cron + "\n" + new_entry
+                new_cron = current_cron + new_entry + "\n"
                 
-                # Update crontab
+                # Update crontab, passing the table on stdin rather than
+                # through a shell so quotes in the command survive intact
                 proc = subprocess.run(
-                    f"echo '{new_cron}' | crontab -",
-                    shell=True,
+                    ["crontab", "-"],
+                    input=new_cron,
                     capture_output=True,
                     text=True
                 )
@@ -455,13 +660,14 @@ def schedule_task(
         return {"error": f"Failed to schedule task: {str(e)}"}
 
 
+_BYTE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+
+
 def _format_bytes(bytes_value: int) -> str:
     """Format bytes in human-readable format."""
-    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-        if bytes_value < 1024.0:
-            return f"{bytes_value:.2f} {unit}"
-        bytes_value /= 1024.0
-    return f"{bytes_value:.2f} PB"
+    # Units step by 2**10, so the unit index follows from the bit length
+    unit = min(max(int(bytes_value).bit_length() - 1, 0) // 10, len(_BYTE_UNITS) - 1)
+    return f"{bytes_value / (1 << (10 * unit)):.2f} {_BYTE_UNITS[unit]}"
 
 
 # Schema definitions for Gemini function calling
@@ -499,6 +705,7 @@ schema_manage_processes = types.FunctionDeclaration(
             "process_name": {"type": "string", "description": "Process name for find action"},
             "pid": {"type": "integer", "description": "Process ID for info/kill actions"},
             "signal_type": {"type": "string", "enum": ["TERM", "KILL", "INT"], "description": "Signal type for kill action"},
+            "detailed": {"type": "boolean", "description": "Include the network connection count for info action (default: false)"},
         },
         "required": ["action"]
     }
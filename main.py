@@ -31,8 +31,9 @@ def main():
     if verbose:
         print(f"User prompt: {user_prompt}\n")
 
+    # The system prompt goes in as system_instruction, not into the message
     messages = [
-        types.Content(role="user", parts=[types.Part(text=system_prompt + '\n' + user_prompt)]),
+        types.Content(role="user", parts=[types.Part(text=user_prompt)]),
     ]
 
     generate_content(client, messages, verbose)
@@ -40,17 +41,18 @@ def main():
 
 def generate_content(client, messages, verbose):
     max_iterations = 40
+    # Same for every iteration, so it is built (and validated) once
+    config = types.GenerateContentConfig(
+        tools=[available_functions], system_instruction=system_prompt
+    )
     
     for iteration in range(max_iterations):
         try:
             # Generate content with the current conversation state
-            print(f'contents (first 2 items): {messages[:2]}')  # Added debug print
             response = client.models.generate_content(
                 model="gemini-2.0-flash-001",
                 contents=messages,
-                config=types.GenerateContentConfig(
-                    tools=[available_functions], system_instruction=system_prompt
-                ),
+                config=config,
             )
             
             if verbose:
@@ -5,35 +5,61 @@ Test suite for the Agent class
 
 import pytest
 from pathlib import Path
+from typing import List
 import sys
 import os
+import time
+import signal
+import logging
+from types import SimpleNamespace
+
+import httpx
 
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from src.agent import Agent
+from google.genai import errors as genai_errors, types
+
+from src.agent import Agent, _is_retryable, _retry_after
 from src.config import Config, ModelType
 from src.conversation import ConversationManager
 
 
+def _test_config(tmp_path: Path) -> Config:
+    """Build a configuration whose files live under ``tmp_path``."""
+    config = Config()
+    config.api_key = os.getenv("GEMINI_API_KEY", "test-key")
+    config.data_dir = tmp_path / "data"
+    config.cache_dir = tmp_path / "cache"
+    config.log_file = tmp_path / "logs" / "test.log"
+    return config
+
+
+# Building an Agent sets up the client and tool schemas, so read-only tests
+# share one instance; tests that change an agent's state use fresh_agent
+@pytest.fixture(scope="class")
+def config(tmp_path_factory):
+    """Create a test configuration."""
+    return _test_config(tmp_path_factory.mktemp("agent"))
+
+
+@pytest.fixture(scope="class")
+def agent(config):
+    """Create a test agent instance."""
+    return Agent(config)
+
+
+@pytest.fixture
+def fresh_agent(tmp_path):
+    """Create an agent, with its own configuration, for a single test."""
+    agent = Agent(_test_config(tmp_path))
+    yield agent
+    agent.cleanup()
+
+
 class TestAgent:
     """Test cases for the Agent class."""
     
-    @pytest.fixture
-    def config(self, tmp_path):
-        """Create a test configuration."""
-        config = Config()
-        config.api_key = os.getenv("GEMINI_API_KEY", "test-key")
-        config.data_dir = tmp_path / "data"
-        config.cache_dir = tmp_path / "cache"
-        config.log_file = tmp_path / "logs" / "test.log"
-        return config
-    
-    @pytest.fixture
-    def agent(self, config):
-        """Create a test agent instance."""
-        return Agent(config)
-    
     def test_agent_initialization(self, agent):
         """Test agent initialization."""
         assert agent is not None
@@ -65,8 +91,9 @@ class TestAgent:
         assert "function_calls" in initial_metrics
         assert initial_metrics["total_requests"] == 0
     
-    def test_session_management(self, agent):
+    def test_session_management(self, fresh_agent):
         """Test session management."""
+        agent = fresh_agent
         # Create a new session
         agent.reset_session()
         assert agent.conversation.current_session is not None
@@ -76,19 +103,20 @@ class TestAgent:
         assert session_id is not None
         assert len(session_id) > 0
     
-    def test_config_updates(self, agent):
+    def test_config_updates(self, agent, monkeypatch):
         """Test configuration updates."""
         # Update model
-        agent.config.model = ModelType.GEMINI_PRO
+        monkeypatch.setattr(agent.config, "model", ModelType.GEMINI_PRO)
         assert agent.config.model == ModelType.GEMINI_PRO
         
         # Update temperature
-        agent.config.temperature = 0.5
+        monkeypatch.setattr(agent.config, "temperature", 0.5)
         assert agent.config.temperature == 0.5
     
     @pytest.mark.skipif(not os.getenv("GEMINI_API_KEY"), reason="API key not available")
-    def test_simple_request(self, agent):
+    def test_simple_request(self, fresh_agent):
         """Test a simple request (requires API key)."""
+        agent = fresh_agent
         response = agent.process_request("What is 2 + 2?")
         assert response is not None
         assert len(response) > 0
@@ -97,8 +125,71 @@ class TestAgent:
         metrics = agent.get_metrics()
         assert metrics["total_requests"] == 1
     
-    def test_cleanup(self, agent, tmp_path):
+    def test_stream_retries_transient_error(self, fresh_agent):
+        """Test a streamed request is retried after a transient API error."""
+        agent = fresh_agent
+        agent.config.context_cache_ttl = 0
+        agent.config.retry_delay = 0.0
+        calls = []
+        
+        def generate_content_stream(**kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                raise genai_errors.APIError(503, {"error": {"message": "overloaded"}})
+            return iter([types.GenerateContentResponse(candidates=[types.Candidate(
+                content=types.Content(role="model", parts=[types.Part(text="4")])
+            )])])
+        
+        agent.client = SimpleNamespace(
+            models=SimpleNamespace(generate_content_stream=generate_content_stream)
+        )
+        
+        assert "".join(agent.process_request_stream("What is 2 + 2?")) == "4"
+        assert len(calls) == 2
+        assert agent.get_metrics()["successful_requests"] == 1
+
+    def test_semantic_cache_matches_same_configuration(self, fresh_agent):
+        """Test a paraphrase reuses an answer only under the same model and prompt."""
+        agent = fresh_agent
+        assert agent.config.semantic_cache_size == 0  # opt-in
+        agent.config.semantic_cache_size = 8
+        agent.config.temperature = 0.0
+        agent.config.context_cache_ttl = 0
+        answers = iter(["four", "FOUR", "vier"])
+
+        def generate_content(**kwargs):
+            return types.GenerateContentResponse(candidates=[types.Candidate(
+                content=types.Content(role="model", parts=[types.Part(text=next(answers))])
+            )])
+
+        # Every prompt embeds to the same vector, so each one is a paraphrase
+        embedding = SimpleNamespace(embeddings=[SimpleNamespace(values=[1.0, 0.0])])
+        agent.client = SimpleNamespace(models=SimpleNamespace(
+            generate_content=generate_content,
+            embed_content=lambda **kwargs: embedding,
+        ))
+
+        def ask(prompt):
+            agent.reset_session()
+            return agent.process_request(prompt)
+
+        assert ask("What is 2 + 2?") == "four"
+        assert ask("What's two plus two?") == "four"
+
+        agent.config.model = ModelType.GEMINI_PRO
+        assert ask("2 + 2 equals?") == "FOUR"
+
+        agent.config.model = ModelType.GEMINI_FLASH
+        agent.config.working_dir = agent.config.data_dir
+        assert ask("Compute 2 + 2") == "vier"
+
+        metrics = agent.get_metrics()
+        assert metrics["semantic_cache_hits"] == 1
+        assert metrics["semantic_cache_misses"] == 3
+
+    def test_cleanup(self, tmp_path):
         """Test cleanup functionality."""
+        agent = Agent(_test_config(tmp_path))
         # Create a session
         agent.reset_session()
         
@@ -114,6 +205,128 @@ class TestAgent:
         assert config_file.exists()
 
 
+def _api_error(code: int, retry_after: str = None) -> genai_errors.APIError:
+    """Build an API error, optionally carrying a Retry-After header."""
+    headers = {"retry-after": retry_after} if retry_after is not None else {}
+    return genai_errors.APIError(
+        code, {"error": {"message": "test"}}, response=httpx.Response(code, headers=headers)
+    )
+
+
+class TestRetryPolicy:
+    """Test cases for the model-call retry helpers."""
+    
+    @pytest.mark.parametrize("error, retryable", [
+        (_api_error(408), True),
+        (_api_error(429), True),
+        (_api_error(500), True),
+        (_api_error(502), True),
+        (_api_error(503), True),
+        (_api_error(504), True),
+        (_api_error(400), False),
+        (_api_error(401), False),
+        (_api_error(403), False),
+        (_api_error(404), False),
+        (httpx.ConnectError("refused"), True),
+        (ConnectionResetError(), True),
+        (TimeoutError(), True),
+        (ValueError("bad request"), False),
+    ])
+    def test_is_retryable(self, error, retryable):
+        """Test which failures are retried."""
+        assert _is_retryable(error) is retryable
+    
+    @pytest.mark.parametrize("header, expected", [
+        ("7", 7.0),
+        ("0.5", 0.5),
+        ("soon", None),
+        ("", None),
+        (None, None),
+    ])
+    def test_retry_after(self, header, expected):
+        """Test reading the Retry-After header."""
+        assert _retry_after(_api_error(429, header)) == expected
+    
+    @pytest.mark.parametrize("header, expected", [
+        ("7", 7.0),
+        ("120", 30.0),
+    ])
+    def test_backoff_honours_capped_retry_after(self, header, expected):
+        """Test Retry-After is used as the delay, capped by retry_max_delay."""
+        owner = SimpleNamespace(config=Config(retry_delay=1.0, retry_max_delay=30.0))
+        assert Agent._backoff_delay(owner, 0, _api_error(429, header)) == expected
+    
+    @pytest.mark.parametrize("attempt, base", [
+        (0, 1.0),
+        (1, 2.0),
+        (3, 8.0),
+        (10, 30.0),
+    ])
+    def test_backoff_jitter_bounds(self, attempt, base):
+        """Test exponential delays stay within the jitter bounds."""
+        owner = SimpleNamespace(config=Config(retry_delay=1.0, retry_max_delay=30.0))
+        delays = [Agent._backoff_delay(owner, attempt, _api_error(503)) for _ in range(200)]
+        assert all(0.5 * base <= delay <= 1.5 * base for delay in delays)
+        assert max(delays) - min(delays) > 0
+
+
+def _text(role: str, text: str) -> types.Content:
+    """A plain text message."""
+    return types.Content(role=role, parts=[types.Part(text=text)])
+
+
+def _tool_round(n: int) -> List[types.Content]:
+    """A model function call and the user-role response to it."""
+    return [
+        types.Content(role="model", parts=[types.Part(
+            function_call=types.FunctionCall(name="list_files", args={"directory": str(n)})
+        )]),
+        types.Content(role="user", parts=[types.Part(
+            function_response=types.FunctionResponse(name="list_files", response={"count": n})
+        )]),
+    ]
+
+
+class TestTrimContext:
+    """Test cases for trimming an over-budget prompt."""
+    
+    def _trim(self, messages, prompt_tokens, budget):
+        owner = SimpleNamespace(
+            config=Config(max_context_tokens=budget), logger=logging.getLogger("test")
+        )
+        usage = types.GenerateContentResponseUsageMetadata(prompt_token_count=prompt_tokens)
+        Agent._trim_context(owner, messages, usage)
+        return messages
+    
+    def test_within_budget(self):
+        """Test nothing is dropped while the prompt fits."""
+        messages = [_text("user", "old"), _text("model", "answer"), _text("user", "now")]
+        assert self._trim(list(messages), 500, 1000) == messages
+    
+    def test_over_budget_history(self):
+        """Test earlier turns are dropped and history resumes at a user message."""
+        old1, a1, old2, a2, current = (
+            _text("user", "old1"), _text("model", "ans1"),
+            _text("user", "old2"), _text("model", "ans2"), _text("user", "curr")
+        )
+        # An excess of about 1.75 messages drops old1, then skips ans1 so the
+        # history still opens with a user message
+        trimmed = self._trim([old1, a1, old2, a2, current], 1000, 650)
+        assert trimmed == [old2, a2, current]
+    
+    def test_over_budget_tool_rounds(self):
+        """Test the oldest tool rounds go but the latest round is kept."""
+        question = _text("user", "question")
+        rounds = _tool_round(1) + _tool_round(2) + _tool_round(3)
+        trimmed = self._trim([question] + rounds, 1000, 1)
+        assert trimmed == [question] + rounds[4:]
+    
+    def test_no_plain_user_message(self):
+        """Test a list of only tool rounds (current defaults to 0) is left intact."""
+        messages = _tool_round(1) + _tool_round(2)
+        assert self._trim(list(messages), 1000, 1) == messages
+
+
 class TestConversation:
     """Test cases for conversation management."""
     
@@ -166,6 +379,41 @@ class TestConversation:
         assert loaded_session is not None
         assert len(loaded_session.messages) == 2
     
+    def test_session_reload_with_archive(self, tmp_path):
+        """Test that saved and archived messages round-trip through the log."""
+        history_dir = tmp_path / "history"
+        manager = ConversationManager(history_dir=history_dir, window_size=2)
+        session = manager.create_session()
+        # The metadata file exists before any save, so a crash keeps the session
+        assert (history_dir / f"{session.session_id}.json").exists()
+
+        contents = [f"message {i}" for i in range(5)]
+        for content in contents:
+            manager.add_message("user", content)
+        log_file = history_dir / f"{session.session_id}.jsonl"
+        # Archiving flushes the log; messages added since wait for a save
+        assert session.archived_count == 2
+        assert len(log_file.read_bytes().splitlines()) == 4
+
+        manager.save_session(session)
+        manager.close_logs()
+        assert len(log_file.read_bytes().splitlines()) == len(contents)
+
+        reloaded = ConversationManager(history_dir=history_dir, window_size=2)
+        loaded = reloaded.get_session(session.session_id)
+        assert [m.content for m in loaded.messages] == contents[-2:]
+        assert loaded.archived_count == 3
+        assert [m.content for m in reloaded.iter_messages(loaded)] == contents
+
+    def test_unsaved_session_is_listed(self, tmp_path):
+        """Test that a session created but never saved is found on reload."""
+        history_dir = tmp_path / "history"
+        session = ConversationManager(history_dir=history_dir).create_session()
+
+        reloaded = ConversationManager(history_dir=history_dir)
+        assert reloaded.get_statistics()["total_sessions"] == 1
+        assert session.session_id in reloaded.sessions
+
     def test_search_functionality(self, manager):
         """Test searching through sessions."""
         # Create sessions with different content
@@ -184,6 +432,35 @@ class TestConversation:
         results = manager.search_sessions("Ruby")
         assert len(results) == 0
 
+    def test_search_archived_and_new_messages(self, tmp_path):
+        """Test that search sees archived messages and ones added after a search."""
+        manager = ConversationManager(history_dir=tmp_path / "history", window_size=2)
+        session = manager.create_session()
+        manager.add_message("user", "Tell me about Python decorators")
+        for i in range(4):
+            manager.add_message("assistant", f"filler {i}")
+        assert session.archived_count > 0
+
+        assert manager.search_sessions("python") == [session]
+        # A fragment of an indexed word falls back to a vocabulary scan
+        assert manager.search_sessions("decorat") == [session]
+        assert manager.search_sessions("Ruby") == []
+
+        manager.add_message("user", "What about Ruby?")
+        assert manager.search_sessions("Ruby") == [session]
+
+    def test_agent_search_history(self, fresh_agent):
+        """Test that Agent.search_history returns session summaries."""
+        fresh_agent.conversation.create_session()
+        fresh_agent.conversation.add_message("user", "Tell me about Python")
+
+        results = fresh_agent.search_history("python")
+        assert len(results) == 1
+        assert results[0]["session_id"] == fresh_agent.conversation.current_session.session_id
+        assert results[0]["messages_count"] == 1
+        assert "Messages: 1" in results[0]["summary"]
+        assert fresh_agent.search_history("ruby") == []
+
 
 class TestFileTools:
     """Test cases for file tools."""
@@ -216,6 +493,45 @@ class TestFileTools:
         assert test_file.exists()
         assert test_file.read_text() == content
     
+    @pytest.mark.skipif(os.name != "posix", reason="POSIX file modes")
+    def test_write_file_keeps_mode(self, tmp_path):
+        """Test overwriting a file keeps its permissions."""
+        from src.tools.file_tools import write_file
+        
+        test_file = tmp_path / "script.sh"
+        test_file.write_text("old")
+        test_file.chmod(0o751)
+        
+        assert write_file(str(test_file), "new").get("success") is True
+        assert test_file.read_text() == "new"
+        assert test_file.stat().st_mode & 0o777 == 0o751
+        assert [p.name for p in tmp_path.iterdir()] == ["script.sh"]
+    
+    def test_write_file_failure_leaves_no_temp_file(self, tmp_path):
+        """Test a failed write cleans up its temporary file."""
+        from src.tools.file_tools import write_file
+        
+        # A directory cannot be replaced by a file
+        target = tmp_path / "target"
+        target.mkdir()
+        
+        assert "error" in write_file(str(target), "content")
+        assert [p.name for p in tmp_path.iterdir()] == ["target"]
+    
+    def test_write_file_concurrent(self, tmp_path):
+        """Test concurrent writes to one path all succeed."""
+        from concurrent.futures import ThreadPoolExecutor
+        from src.tools.file_tools import write_file
+        
+        test_file = tmp_path / "shared.txt"
+        contents = [f"version {i}" for i in range(16)]
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda c: write_file(str(test_file), c), contents))
+        
+        assert all(r.get("success") is True for r in results)
+        assert test_file.read_text() in contents
+        assert [p.name for p in tmp_path.iterdir()] == ["shared.txt"]
+    
     def test_list_files(self, tmp_path):
         """Test listing files."""
         from src.tools.file_tools import list_files
@@ -255,6 +571,21 @@ class TestFileTools:
         # Search by name
         result = search_files(str(tmp_path), name_pattern="test2")
         assert result["results_count"] == 1
+    
+    def test_search_files_large_file(self, tmp_path):
+        """Test searching a file big enough to be memory-mapped."""
+        from src.tools.file_tools import search_files, _MMAP_THRESHOLD
+        
+        lines = ["filler line"] * (_MMAP_THRESHOLD // 12 + 1000)
+        lines[-10] = "the needle is here"
+        (tmp_path / "big.txt").write_text("\n".join(lines))
+        
+        result = search_files(str(tmp_path), content_pattern="needle",
+                              max_file_size=4 * _MMAP_THRESHOLD)
+        assert result["results_count"] == 1
+        assert result["results"][0]["matches"] == [
+            {"line": len(lines) - 9, "content": "the needle is here"}
+        ]
 
 
 class TestSystemTools:
@@ -269,6 +600,45 @@ class TestSystemTools:
         assert result.get("success") is True
         assert "Hello, World!" in result.get("stdout", "")
     
+    def test_run_command_truncates_output(self):
+        """Test only the tail of a long output is kept."""
+        from src.tools.system_tools import run_command
+        
+        result = run_command("seq 1 100000", max_output_bytes=1000)
+        assert result.get("success") is True
+        assert result["output_truncated"] is True
+        assert len(result["stdout"]) == 1000
+        assert result["stdout"].endswith("99999\n100000\n")
+        
+        result = run_command("seq 1 10", max_output_bytes=1000)
+        assert "output_truncated" not in result
+    
+    @pytest.mark.skipif(os.name != "posix", reason="uses a POSIX shell")
+    def test_run_command_timeout_kills_children(self, tmp_path):
+        """Test a timeout kills the command and the processes it started."""
+        import time
+        import psutil
+        from src.tools.system_tools import run_command
+        
+        pid_file = tmp_path / "child.pid"
+        result = run_command(f"sleep 30 & echo $! > {pid_file}; sleep 30", timeout=1)
+        assert "timed out" in result["error"]
+        
+        # SIGKILL is delivered asynchronously; give it a moment to land.
+        # Without a reaping init the killed child can linger as a zombie.
+        # It may already be gone by the time we look it up.
+        child_pid = int(pid_file.read_text())
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            try:
+                if psutil.Process(child_pid).status() == psutil.STATUS_ZOMBIE:
+                    break
+            except psutil.NoSuchProcess:
+                break
+            time.sleep(0.05)
+        else:
+            pytest.fail("background child survived the timeout")
+    
     def test_get_system_info(self):
         """Test getting system information."""
         from src.tools.system_tools import get_system_info
@@ -283,6 +653,134 @@ class TestSystemTools:
         platform = info["platform"]
         assert "system" in platform
         assert "python_version" in platform
+    
+    def test_cpu_reading_covers_minimum_window(self):
+        """Test back-to-back CPU readings sample for at least the minimum window."""
+        import time
+        from src.tools import system_tools
+        
+        system_tools._cpu_percent()
+        start = time.monotonic()
+        usage = system_tools._cpu_percent()
+        assert time.monotonic() - start >= system_tools._MIN_CPU_WINDOW * 0.9
+        assert 0.0 <= usage <= 100.0
+
+
+class TestCLI:
+    """Test cases for the command-line entry point."""
+    
+    @pytest.mark.parametrize("response, language, code", [
+        ("```python\nx = 1\n```", "python", "x = 1"),
+        ("``` python\nx = 1\n```", "python", "x = 1"),
+        ("```c++ \nint x;\n```", "c++", "int x;"),
+        ("```\nplain\n```", "", "plain"),
+        ("```js\nunterminated", "js", "unterminated"),
+    ])
+    def test_code_block_fences(self, response, language, code):
+        """Test fenced code blocks are split into language and code."""
+        from src.cli import _CODE_BLOCK_RE
+        
+        match = _CODE_BLOCK_RE.search(response)
+        assert match.group(1) == language
+        assert match.group(2).strip() == code
+    
+    def test_static_help_matches_parser(self, monkeypatch):
+        """Test the pre-rendered help text matches the real parser."""
+        import agent_main
+        
+        monkeypatch.setenv("COLUMNS", "80")
+        assert agent_main._STATIC_HELP == agent_main._build_parser().format_help()
+
+
+class _EchoAgent:
+    """Stands in for a warm Agent: replies with what the request saw."""
+
+    def __init__(self, idle_timeout: int):
+        self.config = Config(daemon_idle_timeout=idle_timeout)
+        self.logger = logging.getLogger("test_daemon")
+
+    def process_request(self, query, context=None):
+        if query == "die":
+            os._exit(1)
+        return f"{query}|{os.getcwd()}|{self.config.working_dir}|{self.config.temperature}"
+
+    def flush_session(self):
+        pass
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="daemon needs fork")
+class TestDaemon:
+    """Test cases for the warm agent daemon."""
+
+    @pytest.fixture
+    def start_daemon(self, tmp_path, monkeypatch):
+        """Fork a daemon serving an _EchoAgent from a private socket directory."""
+        from src import daemon
+
+        runtime_dir = tmp_path / "run"
+        runtime_dir.mkdir(mode=0o700)
+        monkeypatch.setenv("XDG_RUNTIME_DIR", str(runtime_dir))
+        pids = []
+
+        def start(idle_timeout=30):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    daemon.serve(agent=_EchoAgent(idle_timeout))
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+            for _ in range(100):
+                if daemon.is_running():
+                    return pid
+                time.sleep(0.05)
+            raise AssertionError("daemon did not start")
+
+        yield start
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+
+    @staticmethod
+    def _wait_exit(pid, timeout=5.0):
+        """Whether process ``pid`` exits within ``timeout`` seconds."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if os.waitpid(pid, os.WNOHANG)[0]:
+                return True
+            time.sleep(0.05)
+        return False
+
+    def test_round_trip_and_stop(self, start_daemon, tmp_path):
+        """Test a request runs in the client's directory and stop() ends the daemon."""
+        from src import daemon
+
+        pid = start_daemon()
+        client_dir = tmp_path / "project"
+        client_dir.mkdir()
+        reply = daemon.request({"query": "hi", "cwd": str(client_dir), "temperature": 0.3})
+        cwd = os.path.realpath(client_dir)
+        assert reply == {"response": f"hi|{cwd}|{client_dir}|0.3"}
+
+        # A worker that dies without replying reads as no reply
+        assert daemon.request({"query": "die"}) is None
+        assert daemon.is_running()
+
+        assert daemon.stop()
+        assert self._wait_exit(pid)
+        assert not os.path.exists(daemon.socket_path())
+        assert daemon.request({"query": "hi"}) is None
+
+    def test_idle_timeout(self, start_daemon):
+        """Test the daemon exits after its idle timeout."""
+        from src import daemon
+
+        pid = start_daemon(idle_timeout=1)
+        assert self._wait_exit(pid)
+        assert not daemon.is_running()
 
 
 if __name__ == "__main__":
@@ -1,4 +1,4 @@
-import time
+import asyncio
 import os
 from google import genai
 from dotenv import load_dotenv
@@ -13,32 +13,42 @@ prompt = """A close up of two people staring at a cryptic drawing on a wall, tor
 A man murmurs, 'This must be it. That's the secret code.' The woman looks at him and whispering excitedly, 'What did you find?'"""
 
 
-# Start the generation job
+async def main():
 
-operation = client.models.generate_videos(
+    # Start the generation job
 
-    model="veo-3.0-generate-preview",
+    operation = await client.aio.models.generate_videos(
 
-    prompt=prompt,
+        model="veo-3.0-generate-preview",
 
-)
+        prompt=prompt,
 
+    )
 
-# Poll for the result
 
-while not operation.done:
+    # Poll for the result, backing off from 1 s up to 30 s so short jobs
+    # return quickly and long ones are not polled needlessly
 
-    print("Waiting for video generation to complete...")
+    delay = 1
 
-    time.sleep(10)
+    while not operation.done:
 
-    operation = client.operations.get(operation)
+        print("Waiting for video generation to complete...")
 
+        await asyncio.sleep(delay)
 
-# Download the final video
+        delay = min(delay * 2, 30)
 
-video = operation.response.generated_videos[0]
+        operation = await client.aio.operations.get(operation)
 
-video.video.save("dialogue_example.mp4")
 
-print("Generated video saved to dialogue_example.mp4")
\ No newline at end of file
+    # Download the final video
+
+    video = operation.response.generated_videos[0]
+
+    video.video.save("dialogue_example.mp4")
+
+    print("Generated video saved to dialogue_example.mp4")
+
+
+asyncio.run(main())